@@ -0,0 +1,216 @@
+from contextlib import redirect_stdout
+from datetime import datetime
+from io import StringIO
+from os import path
+from sys import argv
+import json
+import platform
+import tempfile
+import time
+import tracemalloc
+
+import encrouter
+from encrouter import Route, load_rom_data, encounter_search, pop_option
+from formation import formationdict
+from synthrom import synthetic_rom
+
+"""
+Microbenchmarks for the hot paths of the search.
+
+Runs each benchmark a number of times and reports operations per second and the memory still held per operation
+( tracemalloc, with the results of every operation kept alive ), then writes the results as JSON so two versions can
+be compared with --compare. Without --rom the benchmarks run against a synthetic rom ( synthrom.py ) written to a
+temporary file, so they can be run anywhere.
+
+usage: python3 bench.py [--rom FILE] [--route FILE] [--output FILE] [--compare FILE] [--repeat N]
+"""
+
+DEFAULT_ROUTE = "route.short.txt"
+DEFAULT_OUTPUT = "bench.json"
+SEARCH_SEEDS = [5, 17, 244]
+
+
+def start_route(rng, seed=5):
+    """
+    :return: a route for seed which has run the script up to its second travel instruction
+    """
+    route = Route(seed, rng)
+    second_travel = Route.script.index(Route.travelscript[1])
+    while route.scriptptr < second_travel:
+        route.execute_script(debug=False)
+    return route
+
+
+def benchmarks(rng):
+    """
+    :param rng: the rng string returned by load_rom_data
+    :return: list of ( name, setup ) where setup() returns the operation to time as a function of no arguments
+    """
+    def route_copy():
+        route = start_route(rng)
+        return route.copy
+
+    def take_a_step():
+        route = start_route(rng)
+        instr = Route.script[route.scriptptr]
+        return lambda: route.take_a_step(instr, debug=False)
+
+    def predict_encounters():
+        route = start_route(rng)
+        instr = Route.script[route.scriptptr]
+        return lambda: route.copy().predict_encounters(instr, debug=False)
+
+    def predict_formation():
+        route = start_route(rng)
+        fset = Route.script[route.scriptptr].fset
+        return lambda: route.predict_formation(fset)
+
+    def predict_veldt_formation():
+        route = start_route(rng)
+        # every formation of every veldt pack has been seen so any pack can be picked
+        route.seen_formations = sum(1 << formid for pack in Route.veldtpacks.values() for formid in pack
+                                    if formid is not None)
+        return route.predict_veldt_formation
+
+    def force_additional_encounter():
+        route = start_route(rng)
+        route.execute_script(debug=False)
+
+        def force():
+            # time the lookahead for the AVOIDED line rather than its memoised result
+            Route.lookaheads.clear()
+            return route.copy().force_additional_encounter()
+        return force
+
+    def formation_cost():
+        formations = [formationdict[formid] for formid in range(0x200)]
+        return lambda: [f.cost(1.0, False, False) for f in formations]
+
+    def expand():
+        route = start_route(rng)
+        route.execute_script(debug=False)
+        return lambda: route.copy().expand()
+
+    def search():
+        routes = [Route(seed, rng) for seed in SEARCH_SEEDS]
+        def run():
+            with redirect_stdout(StringIO()):
+                return encounter_search([r.copy() for r in routes], number=len(routes), anynode=False)
+        return run
+
+    return [
+        ("Route.copy", route_copy),
+        ("Route.take_a_step", take_a_step),
+        ("Route.predict_encounters", predict_encounters),
+        ("Route.predict_formation", predict_formation),
+        ("Route.predict_veldt_formation", predict_veldt_formation),
+        ("Route.force_additional_encounter", force_additional_encounter),
+        ("Formation.cost x512", formation_cost),
+        ("Route.expand", expand),
+        ("encounter_search", search),
+    ]
+
+
+def calibrate(operation, target=0.2):
+    """
+    :return: the number of operations which takes about target seconds
+    """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            operation()
+        elapsed = time.perf_counter() - start
+        if elapsed >= target or number >= 1 << 20:
+            return number
+        number *= 2 if elapsed <= 0 else max(2, min(10, int(target / elapsed) + 1))
+
+
+def measure(setup, repeat):
+    """
+    :param setup: returns the operation to time
+    :param repeat: the number of timed runs, the fastest is reported
+    :return: dict of the results
+    """
+    operation = setup()
+    number = calibrate(operation)
+    best = None
+    for _ in range(repeat):
+        operation = setup()
+        start = time.perf_counter()
+        for _ in range(number):
+            operation()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    operation = setup()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    results = [operation() for _ in range(number)]
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del results
+    return {
+        "number": number,
+        "repeat": repeat,
+        "seconds_per_op": best / number,
+        "ops_per_sec": number / best,
+        "bytes_per_op": held / number,
+    }
+
+
+def compare(results, baseline):
+    """
+    Prints the speed of results relative to baseline for every benchmark in both
+    """
+    print()
+    print("%-36s %14s %14s %8s" % ("benchmark", "baseline op/s", "op/s", "change"))
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]["ops_per_sec"]
+        after = result["ops_per_sec"]
+        print("%-36s %14.1f %14.1f %+7.1f%%" % (name, before, after, (after / before - 1) * 100))
+
+
+def run(args):
+    rom = pop_option(args, "--rom")
+    routefile = pop_option(args, "--route", DEFAULT_ROUTE)
+    output = pop_option(args, "--output", DEFAULT_OUTPUT)
+    baseline = pop_option(args, "--compare")
+    repeat = int(pop_option(args, "--repeat", 5))
+
+    with tempfile.TemporaryDirectory() as directory:
+        if rom is None:
+            filename = path.join(directory, "synthetic.smc")
+            synthetic_rom(filename)
+        else:
+            filename = rom
+        rng = load_rom_data(filename, routefile)
+
+        results = {}
+        print("%-36s %14s %14s %12s" % ("benchmark", "op/s", "usec/op", "bytes/op"))
+        for name, setup in benchmarks(rng):
+            result = measure(setup, repeat)
+            results[name] = result
+            print("%-36s %14.1f %14.2f %12.1f" % (name, result["ops_per_sec"], result["seconds_per_op"] * 1e6,
+                                                  result["bytes_per_op"]))
+
+    with open(output, "w") as f:
+        json.dump({
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "rom": rom or "synthetic",
+            "route": routefile,
+            "debug_logging": encrouter.ALLOW_DEBUG_LOGGING,
+            "results": results,
+        }, f, indent=2)
+    print("Wrote %s" % output)
+
+    if baseline is not None:
+        with open(baseline) as f:
+            compare(results, json.load(f)["results"])
+
+
+if __name__ == "__main__":
+    run(list(argv))
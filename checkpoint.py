@@ -0,0 +1,203 @@
+from os import path, replace, remove
+from time import perf_counter
+import gzip
+import pickle
+from fringe import Fringe
+from transposition import TranspositionTable
+
+"""
+Checkpoints of encrouter.encounter_search so a long search which is stopped can carry on where it was.
+
+A checkpoint holds the fringe, the transposition table, the solutions accepted so far, the search's counters, the next
+Route id and how much of the report was written. It is pickled straight into a gzip file ( fast compression, written
+next to the checkpoint and renamed over it ) so nothing but the routes' own data is built in memory to save it. The
+travel logs and merged seed chains routes share are written once each as flat tables rather than as nested tuples,
+which pickle would have to recurse through.
+
+Checkpoints are written at most every interval seconds and never more often than COST_RATIO times the time the last
+one took, so saving one can not take more than a small share of the search. Resuming from a checkpoint continues the
+search exactly as if it had never stopped.
+"""
+
+CHECKPOINT_VERSION = 1
+"""Increase when the checkpoint contents change shape"""
+COST_RATIO = 50
+"""Checkpoints are at least this many times the duration of the last one apart"""
+UNSET = Ellipsis
+"""Stands in for a Route slot which was never set"""
+
+
+class CheckpointError(Exception):
+    """
+    Raised when a checkpoint can not be resumed
+    """
+    pass
+
+
+class Chains:
+    """
+    Flattens ( parent, ... ) chains of tuples ( Route.log_tail and Route.shared ) into a list of ( parent index, ... )
+    nodes, each shared node listed once and always after its parent
+    """
+
+    def __init__(self):
+        self.index = {} # id of a chain node -> its position in nodes
+        self.nodes = []
+
+    def add(self, tail):
+        """
+        :param tail: the last node of a chain or None
+        :return: the position of tail in nodes, -1 for None
+        """
+        if tail is None:
+            return -1
+        first = tail
+        pending = []
+        while tail is not None and id(tail) not in self.index:
+            pending.append(tail)
+            tail = tail[0]
+        for node in reversed(pending):
+            parent = node[0]
+            self.index[id(node)] = len(self.nodes)
+            self.nodes.append((-1 if parent is None else self.index[id(parent)],) + node[1:])
+        return self.index[id(first)]
+
+
+def build_chains(nodes):
+    """
+    :param nodes: Chains.nodes
+    :return: list of the chain tuples rebuilt, in the same order
+    """
+    built = []
+    for node in nodes:
+        built.append((None if node[0] < 0 else built[node[0]],) + node[1:])
+    return built
+
+
+class Checkpoint:
+
+    def __init__(self, filename, key, interval=300):
+        """
+        :param filename: the checkpoint file
+        :param key: anything picklable which identifies the search ( rom, route file, seeds and options ), a
+                    checkpoint is only resumed by a search with the same key
+        :param interval: the least number of seconds between checkpoints
+        """
+        self.filename = filename
+        self.key = key
+        self.interval = interval
+        self.last = perf_counter()
+        self.seconds = 0
+
+    def due(self):
+        """
+        :return: True if it is time for a checkpoint
+        """
+        return perf_counter() - self.last >= max(self.interval, self.seconds * COST_RATIO)
+
+    def save(self, fringe, transpositions, counters, solutions, routeclass, report=None):
+        """
+        :param fringe: the search's fringe.Fringe
+        :param transpositions: the search's transposition.TranspositionTable
+        :param counters: dict of the search's counters
+        :param solutions: the solutions accepted and not written to report
+        :param routeclass: encrouter.Route
+        :param report: the report.Report solutions are written to or None
+        :return: None
+        """
+        start = perf_counter()
+        slots = routeclass.__slots__
+        logs = Chains()
+        shared = Chains()
+
+        def pack(route):
+            values = [getattr(route, slot, UNSET) for slot in slots]
+            values[slots.index("log_tail")] = logs.add(route.log_tail)
+            values[slots.index("shared")] = shared.add(route.shared)
+            values[slots.index("rng")] = None
+            return values
+
+        queue = [(priority, order, pack(route)) for priority, order, route in fringe.entries()]
+        states = dict((ptr, dict((key, entry[:3] + [shared.add(entry[3])]) for key, entry in entries.items()))
+                      for ptr, entries in transpositions.states.items())
+        data = {
+            "version": CHECKPOINT_VERSION,
+            "key": self.key,
+            "slots": slots,
+            "next_id": routeclass.next_id,
+            "counters": counters,
+            "report": None if report is None else report.state(),
+            "solutions": [pack(route) for route in solutions],
+            "order": fringe.order,
+            "superseded": transpositions.superseded,
+            "merged": transpositions.merged,
+            "states": states,
+            "queue": queue,
+            "logs": logs.nodes,
+            "shared": shared.nodes,
+        }
+        temporary = self.filename + ".tmp"
+        with gzip.open(temporary, "wb", compresslevel=1) as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        replace(temporary, self.filename)
+        self.last = perf_counter()
+        self.seconds = self.last - start
+        print("Checkpoint of %s routes written to %s in %.2f seconds" % (len(queue), self.filename, self.seconds))
+
+    def load(self, routeclass, rng):
+        """
+        :param routeclass: encrouter.Route, its script must already be loaded
+        :param rng: the rng string the routes were made with
+        :return: dict with the restored fringe, transpositions, solutions, counters and report state for
+                 encounter_search's resume argument
+        """
+        try:
+            with gzip.open(self.filename, "rb") as f:
+                data = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError) as e:
+            raise CheckpointError("Can not read checkpoint %s: %s" % (self.filename, e))
+        if data.get("version") != CHECKPOINT_VERSION:
+            raise CheckpointError("%s was written by another version of the program" % self.filename)
+        if data["key"] != self.key:
+            raise CheckpointError("%s is a checkpoint of another search, the rom, route file, seeds and options must "
+                                  "be the same to resume it" % self.filename)
+        slots = data["slots"]
+        logs = build_chains(data["logs"])
+        shared = build_chains(data["shared"])
+
+        def unpack(values):
+            route = routeclass.__new__(routeclass)
+            for slot, value in zip(slots, values):
+                if value is not UNSET:
+                    setattr(route, slot, value)
+            route.log_tail = None if values[slots.index("log_tail")] < 0 else logs[values[slots.index("log_tail")]]
+            route.shared = None if values[slots.index("shared")] < 0 else shared[values[slots.index("shared")]]
+            route.rng = rng
+            return route
+
+        fringe = Fringe()
+        fringe.restore([(priority, order, unpack(values)) for priority, order, values in data["queue"]])
+        fringe.order = data["order"]
+        transpositions = TranspositionTable(routeclass.script)
+        transpositions.states = dict(
+            (ptr, dict((key, entry[:3] + [None if entry[3] < 0 else shared[entry[3]]])
+                       for key, entry in entries.items()))
+            for ptr, entries in data["states"].items())
+        transpositions.superseded = data["superseded"]
+        transpositions.merged = data["merged"]
+        routeclass.next_id = data["next_id"]
+        print("Resuming from %s with %s routes" % (self.filename, len(fringe)))
+        return {
+            "fringe": fringe,
+            "transpositions": transpositions,
+            "solutions": [unpack(values) for values in data["solutions"]],
+            "counters": data["counters"],
+            "report": data["report"],
+        }
+
+    def remove(self):
+        """
+        Deletes the checkpoint once the search is over
+        """
+        if path.exists(self.filename):
+            remove(self.filename)
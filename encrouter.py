@@ -1,10 +1,31 @@
 from datetime import datetime
+from time import perf_counter
 from sys import argv
-from monster import monsters_from_table
-from formation import formations_from_rom, fsets_from_rom
-from queue import PriorityQueue
+from monster import monsters_from_table, monsterdict
+from formation import formations_from_rom, fsets_from_rom, cost_table, index_formations, enemy_formations
+from fringe import Fringe
+from rom import Rom
+from snapshot import load_snapshot, save_snapshot, file_hash
+from transposition import TranspositionTable, chain_seeds
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from rng import StepRNG, BattleRNG
+from river import LeteRiver, load_tables
+from report import Report
+from searchstats import SearchStats
+from profiling import Profiler, profile_phase
+from checkpoint import Checkpoint
+from os import path
+from travelog import (LOG_TEXT, LOG_DEBUG, LOG_ZONE, LOG_ENCOUNTER, LOG_RANDOM, LOG_RIVER, LOG_EVENT,
+                      LOG_LETE_SEED, LOG_VELDT_PENALTY, LOG_EXTRA_STEPS, render_event, iter_events,
+                      render_travelog)
 import logging
 from inspect import currentframe, getframeinfo
+try:
+    import lockstep
+except ImportError:
+    # numpy is not installed, every route walks the start of the script on its own
+    lockstep = None
 
 JAPAN = False
 STEP_VALUE = 0.5
@@ -71,18 +92,32 @@ def get_queue_other_items(selected_node, queue):
         return None
 
 
+class NoSolutionsError(Exception):
+    """
+    Raised by encounter_search when the fringe runs out before any solution is found
+    """
+    pass
+
+
 class MethodContextLogger:
     """
     Used to simplify logging standard info which includes enclosing method, line number, route, and instruction context
-    as well as an optional free-form message
+    as well as an optional free-form message.
+    Messages are %-formatted with their arguments only when they are written, so pass the arguments separately ie:
+    method_logger.log("cost: %s", self.cost) and wrap calls whose arguments are expensive to work out ( log_string and
+    such ) in an if ALLOW_DEBUG_LOGGING: block. Create loggers with context_logger.
     """
     def __init__(self, method_name=None, route=None, instr=None):
         self.method_name = method_name
         self.route = route
+        if instr is None and route is not None and route.scriptptr < Route.scriptlength:
+            instr = Route.script[route.scriptptr]
         self.instr = instr
 
-    def log(self, message=None):
+    def log(self, message=None, *args):
         if ALLOW_DEBUG_LOGGING:
+            if args:
+                message = message % args
             line_num = currentframe().f_back.f_lineno
             log_info(method_name=self.method_name, route=self.route, instr=self.instr, line_num=line_num, queue_size=None,
                      selected_node=None, queue=None, message=message)
@@ -94,34 +129,49 @@ class MethodContextLogger:
                      selected_node=selected_node, queue=queue, message=message)
 
 
-def table_from_file(filename, hexify=False):
-    table = {}
-    for line in open(filename):
-        line = line.strip()
-        if line[0] == '#':
-            continue
-        while '  ' in line:
-            line = line.replace('  ', ' ')
-        a, b = tuple(line.split())
-        if hexify:
-            try:
-                a = int(a, 0x10)
-                b = int(b, 0x10)
-            except ValueError:
-                continue
-        table[a] = b
-    return table
+class NullLogger:
+    """
+    Stands in for MethodContextLogger while ALLOW_DEBUG_LOGGING is off. A single instance is shared by every method so
+    the disabled path allocates nothing and formats nothing.
+    """
+    __slots__ = ()
 
+    def log(self, message=None, *args):
+        pass
+
+    def lqueue(self, selected_node=None, queue_size=None, queue=None, message=None):
+        pass
+
+    @property
+    def route(self):
+        return None
+
+    @route.setter
+    def route(self, route):
+        pass
+
+
+NULL_LOGGER = NullLogger()
 
-def get_rng_string(filename):
-    f = open(filename, 'r+b')
-    f.seek(0xFD00)
-    rng = list(f.read(0x100))
-    return rng
+
+def context_logger(method_name=None, route=None, instr=None):
+    """
+    :param method_name: the name of the method logging
+    :param route: the Route being worked on, if any
+    :param instr: the Instruction being worked on, defaults to the instruction at route.scriptptr
+    :return: a MethodContextLogger if ALLOW_DEBUG_LOGGING is on otherwise the shared NULL_LOGGER
+    """
+    if ALLOW_DEBUG_LOGGING:
+        return MethodContextLogger(method_name, route, instr)
+    return NULL_LOGGER
+
+
+def get_rng_string(rom):
+    return rom.bytes(0xFD00, 0x100)
 
 
 def get_reset_bunch(node, ones=2, fourteens=2):
-    method_logger = MethodContextLogger("get_reset_bunch")
+    method_logger = context_logger("get_reset_bunch")
     method_logger.log("Start get_reset_bunch")
     if JAPAN:
         ones += 1
@@ -142,21 +192,57 @@ def get_reset_bunch(node, ones=2, fourteens=2):
             child2 = child.copy()
             resetted2.append(child2)
 
-    method_logger.log("Returning resetted2: %s" % str(resetted2))
+    if ALLOW_DEBUG_LOGGING:
+        method_logger.log("Returning resetted2: %s" % str(resetted2))
     method_logger.log("End get_reset_bunch")
     return resetted2
 
 
+def first_seen_slots():
+    """
+    Route.seen_formations is a bitmask with bit formid set for every formation seen, so the 8 formations of veldt pack
+    n are the 8 bits from bit 8 * n.
+    :return: table where table[slots][start] is the first set bit of the 8 bit value slots at or after start, wrapping
+             around to bit 0, or None if slots is 0
+    """
+    table = []
+    for slots in range(0x100):
+        row = []
+        for start in range(8):
+            seen = [slot & 0x07 for slot in range(start, start + 8) if slots & (1 << (slot & 0x07))]
+            row.append(seen[0] if seen else None)
+        table.append(row)
+    return table
+
+
+FIRST_SEEN_SLOT = first_seen_slots()
+
+
 class Route():
+    """
+    A Route is a single node of the search. Routes are created and copied constantly so instance state lives in
+    __slots__ rather than a per instance __dict__ which keeps each node in the fringe small and makes copy() cheap.
+    """
+    __slots__ = ("initialseed", "seed", "veldtseed", "stepseed", "battleseed",
+                 "stepcounter", "battlecounter", "threat", "rng", "cost",
+                 "log_tail", "scriptptr", "boundary_flag",
+                 "overworld_threatrate", "last_forced_encounter",
+                 "last_reset", "num_encounters", "xp", "weight",
+                 "smokebombs", "seen_formations", "gau_encounters", "id",
+                 "veldt_up", "shared")
     scriptlength = 0
     script = []
     fsets = {}
     formations = {}
     travelscript = []
-    riversequence = {}
-    leterng = {}
-    returnerrng = {}
+    river = None # LeteRiver built from the lete river tables
     veldtpacks = {}
+    veldtmasks = {} # 8 bit mask of the slots of each veldt pack which hold a formation, see format_script
+    lookaheads = {} # memoised results of Route.lookahead
+    maxlookaheads = 0x40000
+    lowerbounds = [0] # lowest possible cost from each script position to the end, see remaining_cost_bounds
+    steprng = None # StepRNG built from the rom's rng table
+    battlerng = None # BattleRNG built from the rom's rng table
     next_id = 0
 
     def __init__(self, seed=None, rng=None, threat=0):
@@ -165,7 +251,7 @@ class Route():
         self.threat = threat
         self.rng = rng
         self.cost = 0
-        self.travelog = ""
+        self.log_tail = None # most recent travel log event, see LOG_FORMATS
         self.scriptptr = 0 # the index of the Instruction within Route.script which will be processed next
         self.boundary_flag = False
         self.overworld_threatrate = None
@@ -176,8 +262,9 @@ class Route():
         self.xp = 0
         self.weight = 1.0
         self.smokebombs = False
-        self.seen_formations = set([])
+        self.seen_formations = 0 # bit formid is set for every formation seen
         self.gau_encounters = 0
+        self.shared = None # initial seeds merged into this route's states, see transposition.TranspositionTable
         self.id = Route.next_id
         Route.next_id += 1
 
@@ -208,6 +295,20 @@ class Route():
             s += "%s: %s\n" % (attribute, getattr(self, attribute))
         return s.strip()
 
+    @property
+    def travelog(self):
+        return render_travelog(self.log_tail, Route.formations)
+
+    def log_event(self, kind, *args):
+        self.log_tail = (self.log_tail, kind) + args
+
+    def log_text(self, text):
+        self.log_tail = (self.log_tail, LOG_TEXT, text)
+
+    def log_debug(self):
+        self.log_tail = (self.log_tail, LOG_DEBUG, self.stepseed, self.stepcounter, self.battleseed,
+                         self.battlecounter, self.threat, self.cost)
+
     @property
     def debug_string(self):
         debug_string = "--- %x %x %x %x %x %s\n" % (
@@ -229,7 +330,7 @@ class Route():
             'battlecounter': self.battlecounter,
             'threat': self.threat,
             'cost': self.cost,
-            'travelog': self.travelog,
+            'last_log': render_event(self.log_tail, Route.formations) if self.log_tail else None,
             'scriptptr': self.scriptptr,
             'boundary_flag': self.boundary_flag,
             'overworld_threatrate': self.overworld_threatrate,
@@ -239,14 +340,30 @@ class Route():
             'xp': self.xp,
             'weight': self.weight,
             'smokebombs': self.smokebombs,
-            'seen_formations': self.seen_formations,
+            'seen_formations': self.seen_formids,
             'gau_encounters': self.gau_encounters,
         })
 
+    @property
+    def seen_formids(self):
+        """
+        :return: sorted list of the ids of the formations seen
+        """
+        return [formid for formid in range(self.seen_formations.bit_length()) if self.seen_formations >> formid & 1]
+
     @property
     def short_string(self):
         return "(id: %s, cost: %s, script_ptr: %s, num_encounters: %s)" % (self.id, round(self.cost, 2), self.scriptptr, self.num_encounters)
 
+    @property
+    def shared_seeds(self):
+        """
+        :return: sorted list of the other initial seeds which reach the same states as this route
+        """
+        seeds = chain_seeds(self.shared)
+        seeds.discard(self.initialseed)
+        return sorted(seeds)
+
     @property
     def previous_instr(self):
         if self.scriptptr > 0:
@@ -264,79 +381,91 @@ class Route():
         self.stepcounter = seed
         self.battlecounter = seed
 
+    def __getstate__(self):
+        state = dict((name, getattr(self, name)) for name in Route.__slots__ if hasattr(self, name))
+        # pickle recurses into nested tuples so the travel log chain is flattened to a list of events
+        state["log_tail"] = [event[1:] for event in iter_events(self.log_tail)]
+        state["shared"] = self.shared_seeds
+        return state
+
+    def __setstate__(self, state):
+        events = state.pop("log_tail")
+        shared = state.pop("shared")
+        for name, value in state.items():
+            setattr(self, name, value)
+        self.shared = (None, set(shared))
+        self.log_tail = None
+        for event in events:
+            self.log_event(*event)
+
     def copy(self):
-        new = Route()
-        for attribute in ["initialseed", "stepseed", "battleseed", "veldtseed",
-                          "stepcounter", "battlecounter", "threat",
-                          "rng", "cost", "travelog", "scriptptr", "seed",
-                          "boundary_flag", "weight", "smokebombs",
-                          "last_forced_encounter", "last_reset",
-                          "overworld_threatrate", "xp", "num_encounters",
-                          "gau_encounters"]:
-            setattr(new, attribute, getattr(self, attribute))
-        new.seen_formations = set(self.seen_formations)
+        """
+        Clones this route. Bypasses __init__ ( and so set_seed ) since every attribute is overwritten anyway.
+        :return: a new Route with the same state and a new id
+        """
+        new = Route.__new__(Route)
+        new.initialseed = self.initialseed
+        new.seed = self.seed
+        new.veldtseed = self.veldtseed
+        new.stepseed = self.stepseed
+        new.battleseed = self.battleseed
+        new.stepcounter = self.stepcounter
+        new.battlecounter = self.battlecounter
+        new.threat = self.threat
+        new.rng = self.rng
+        new.cost = self.cost
+        new.log_tail = self.log_tail
+        new.scriptptr = self.scriptptr
+        new.boundary_flag = self.boundary_flag
+        new.weight = self.weight
+        new.smokebombs = self.smokebombs
+        new.last_forced_encounter = self.last_forced_encounter
+        new.last_reset = self.last_reset
+        new.overworld_threatrate = self.overworld_threatrate
+        new.xp = self.xp
+        new.num_encounters = self.num_encounters
+        new.gau_encounters = self.gau_encounters
+        new.seen_formations = self.seen_formations
+        new.shared = self.shared
+        new.id = Route.next_id
+        Route.next_id += 1
         return new
 
     def get_best_river(self, battles=1):
-        method_logger = MethodContextLogger("get_best_river", self, Route.script[self.scriptptr])
+        method_logger = context_logger("get_best_river", self)
         method_logger.log("Start get_best_river")
         #self.reset_fourteen()
         self.overworld_threatrate = None
-        try:
-            seed = Route.leterng[self.seed]
-            method_logger.log("seed %s" % seed)
-        except KeyError:
-            method_logger.log("seed not found!")
-            return False
-
-        best = None
-        cost, bestcost = 0, 0
-        bestnum = 0
-        for i in range(0x100):
-            battlecounter = Route.riversequence[seed].count(True)
-            if battlecounter == 2 + battles:
-                temp = self.copy()
-                if temp.predict_river(seed):
-                    best = seed
-                    bestcost = cost
-                    bestnum = i
-                    break
-            #self.cost += STEP_VALUE * 2
-            #cost += 0.1
-            seed = Route.returnerrng[seed]
-        if best is None:
+        # the first lete seed along the returner rng with the wanted number of fights, see river.LeteRiver
+        choice = Route.river.choice(self.seed, battles)
+        if choice is None:
+            method_logger.log("no lete seed for seed %s", self.seed)
             return False
 
-        self.travelog += "*** MANIPULATE LETE W/ RETURNER TO SEED %s ***\n" % (best)
+        best, steps, fights = choice
+        self.log_event(LOG_LETE_SEED, best)
         self.predict_river(best)
-        self.cost += bestcost
         self.scriptptr += 1
-        method_logger.log("%s -> %s" % (best, cost))
+        method_logger.log("%s -> %s after %s returner steps", self.seed, best, steps)
         method_logger.log("End get_best_river")
         return True
 
     def predict_river(self, seed):
-        method_logger = MethodContextLogger("predict_river", self, Route.script[self.scriptptr])
+        method_logger = context_logger("predict_river", self)
         method_logger.log("Start predict_river")
-        sequence = Route.riversequence[seed]
-        method_logger.log("Sequence %s" % sequence)
-        formids = [0x107, 0x108, 0x107, 0x107, 0x108, 0x107, 0x108, 0x108, 0x107]
-        double_pterodon = False
-        for decision, formid in zip(sequence, formids):
-            if decision:
-                fset = fsetdict[formid]
-                self.num_encounters += 1
-                formation = self.predict_formation(fset)
-                if formation.formid == 0x23:
-                    double_pterodon = True
-                self.xp += formation.xp
-                cost = formation.cost(self.weight, self.smokebombs)
-                self.cost += cost
-                self.travelog += "RIVER: " + str(formation) + " COST: %s" % cost + "\n"
-                method_logger.log("{decision: %s, formation: %s, xp: %s, cost: %s, fset: %s}" % (decision, formation, formation.xp, cost, fset))
+        formations, self.battlecounter, self.battleseed = Route.river.outcome(seed, self.battlecounter,
+                                                                              self.battleseed)
+        for formation in formations:
+            self.num_encounters += 1
+            if formation.formid < 0x200:
+                self.seen_formations |= 1 << formation.formid
+            self.xp += formation.xp
+            cost = self.formation_cost(formation)
+            self.cost += cost
+            self.log_event(LOG_RIVER, formation.formid, cost)
+            method_logger.log("{formation: %s, xp: %s, cost: %s}", formation, formation.xp, cost)
         method_logger.log("End predict_river")
         return True
-        #return double_pterodon # unreachable code I commented out
 
     def predict_formation(self, fset):
         """
@@ -344,22 +473,17 @@ class Route():
         :param fset:
         :return:
         """
-        method_logger = MethodContextLogger("predict_formation", self, Route.script[self.scriptptr])
+        method_logger = context_logger("predict_formation", self)
         method_logger.log("Start predict_formation")
         self.increment_battle(rng=True)
-        value = self.rng[self.battlecounter]
-        value = (value + self.battleseed) & 0xFF # values between 0 and 255 inclusive
-        method_logger.log("{ value: %s, battlecounter: %s, battleseed: %s self.rng[self.battlecounter]: %s }" % (value, self.battlecounter, self.battleseed, self.rng[self.battlecounter]))
-        if len(fset.formations) == 4:
-            value = value // 0x50
-        else:
-            value = value // 0xC0
+        value = Route.battlerng.slot(self.battlecounter, self.battleseed, len(fset.formations))
+        method_logger.log("{ slot: %s, battlecounter: %s, battleseed: %s self.rng[self.battlecounter]: %s }", value, self.battlecounter, self.battleseed, self.rng[self.battlecounter])
         formation = fset.formations[value]
-        method_logger.log("Predicted formation %s" % formation)
+        method_logger.log("Predicted formation %s", formation)
         if formation.formid < 0x200:
-            method_logger.log("Adding formation.formid %s to seen formations" % formation.formid)
-            self.seen_formations.add(formation.formid)
-        method_logger.log("Returning formation %s" % formation)
+            method_logger.log("Adding formation.formid %s to seen formations", formation.formid)
+            self.seen_formations |= 1 << formation.formid
+        method_logger.log("Returning formation %s", formation)
         method_logger.log("End predict_formation")
         return formation
 
@@ -368,7 +492,7 @@ class Route():
         Predicts if a battle will be encountered based on the step counter, step seed, threat, and rng string
         :return:
         """
-        method_logger = MethodContextLogger("predict_battle", self, Route.script[self.scriptptr])
+        method_logger = context_logger("predict_battle", self)
         method_logger.log("Predicting battle from step counter")
         self.increment_step(rng=True)
         value = self.rng[self.stepcounter]
@@ -385,64 +509,53 @@ class Route():
         Predicts a veldt battle monster formation which will be encountered
         :return:
         """
-        method_logger = MethodContextLogger("predict_veldt_formation", self, Route.script[self.scriptptr])
-        method_logger.log("Start predict_veldt_formation with veldtseed=%d" % self.veldtseed)
+        method_logger = context_logger("predict_veldt_formation", self)
+        method_logger.log("Start predict_veldt_formation with veldtseed=%d", self.veldtseed)
         self.veldtseed += 1
         while True:
             self.veldtseed = self.veldtseed & 0x3F
-            pack = Route.veldtpacks[self.veldtseed]
-            method_logger.log("Veldt pack is %s" % pack)
-            if set(pack) & self.seen_formations:
+            # the slots of the pack holding formations which were seen
+            slots = (self.seen_formations >> (self.veldtseed << 3)) & Route.veldtmasks[self.veldtseed]
+            method_logger.log("Veldt pack is %s, seen slots %s", Route.veldtpacks[self.veldtseed], slots)
+            if slots:
                 break
 
             self.veldtseed += 1
 
-        method_logger.log("updated veldtseed is %s" % self.veldtseed)
+        method_logger.log("updated veldtseed is %s", self.veldtseed)
         self.increment_battle(rng=True)
-        value = self.rng[self.battlecounter]
-        value = (value + self.battleseed)
-        method_logger.log("self.rng[self.battlecounter] + self.battleseed is %s" % value)
-        while True:
-            value = value & 0x07
-            method_logger.log("Value for pack selection is %s" % value)
-            formid = pack[value]
-            method_logger.log("Formation id is %s" % formid)
-            if formid in self.seen_formations:
-                method_logger.log("Breaking as formation id was seen. formation %s" % formid)
-                break
-            value += 1
+        value = Route.battlerng.value(self.battlecounter, self.battleseed)
+        method_logger.log("self.rng[self.battlecounter] + self.battleseed is %s", value)
+        formid = Route.veldtpacks[self.veldtseed][FIRST_SEEN_SLOT[slots][value & 0x07]]
+        method_logger.log("Formation id is %s", formid)
 
         formation = Route.formations[formid]
-        method_logger.log("Returning formation %s" % formation)
+        method_logger.log("Returning formation %s", formation)
         method_logger.log("End predict_veldt_formation")
         return formation
 
     def increment_step(self, rng=True):
-        method_logger = MethodContextLogger("increment_step", self, Route.script[self.scriptptr])
-        method_logger.log("Start increment_step with { rng: %s, stepcounter: %s, stepseed: %s }" % (rng, self.stepcounter, self.stepseed))
+        method_logger = context_logger("increment_step", self)
+        method_logger.log("Start increment_step with { rng: %s, stepcounter: %s, stepseed: %s }", rng, self.stepcounter, self.stepseed)
         self.stepcounter = (self.stepcounter+1) & 0xFF
-        method_logger.log("Updated stepcounter to %s" % self.stepcounter)
+        method_logger.log("Updated stepcounter to %s", self.stepcounter)
         if self.stepcounter == 0 and rng:
             self.stepseed += 0x11
             self.stepseed = self.stepseed & 0xFF
-            method_logger.log("Updated stepseed to %s" % self.stepseed)
+            method_logger.log("Updated stepseed to %s", self.stepseed)
         method_logger.log("End increment_step")
 
     def increment_battle(self, rng=True):
         """
-        Value of rng is ALWAYS True at runtime
+        Value of rng is ALWAYS True at runtime so the battleseed is always rolled when the counter wraps
         :param rng: always True
         :return:
         """
-        method_logger = MethodContextLogger("increment_battle", self, Route.script[self.scriptptr])
-        method_logger.log("Start increment_battle with {rng: %s, battlecounter: %s, battleseed: %s}" % (rng, self.battlecounter, self.battleseed))
-        # I assume the battlecounter has a max size of 255 so this masking allows handles keeping battlecounter: 0 >= value <= 255
-        self.battlecounter = (self.battlecounter+1) & 0xFF
-        method_logger.log("Updated battlecounter to %s" % self.battlecounter)
-        if self.battlecounter == 0 and rng:
-            self.battleseed += 0x17 # += 23 I am guessing for some reason internal to the logic of the game
-            self.battleseed = self.battleseed & 0xFF # values allowed are between 0 and 255
-            method_logger.log("Updated battleseed to %s" % self.battleseed)
+        method_logger = context_logger("increment_battle", self)
+        method_logger.log("Start increment_battle with {rng: %s, battlecounter: %s, battleseed: %s}", rng, self.battlecounter, self.battleseed)
+        # the battlecounter is a single byte, each time it wraps to 0 the battleseed is rolled by 0x17
+        self.battlecounter, self.battleseed = BattleRNG.advance(self.battlecounter, self.battleseed)
+        method_logger.log("Updated battlecounter to %s and battleseed to %s", self.battlecounter, self.battleseed)
         method_logger.log("End increment_battle")
 
     def execute_script(self, debug=True):
@@ -453,51 +566,53 @@ class Route():
         :param debug:
         :return:
         """
-        method_logger = MethodContextLogger("execute_script", self, Route.script[self.scriptptr])
-        method_logger.log("Start execute_script with { debug: %s }" % debug)
+        method_logger = context_logger("execute_script", self)
+        method_logger.log("Start execute_script with { debug: %s }", debug)
         if (self.previous_instr and self.previous_instr.veldt
                 and not self.previous_instr.avoidgau):
             # look for gau
-            method_logger.log("Looking for gau. Current num_encounters = %s" % self.num_encounters)
+            method_logger.log("Looking for gau. Current num_encounters = %s", self.num_encounters)
             starting_num_encounters = self.num_encounters
             while self.gau_encounters <= 1:
-                method_logger.log("Gau not found! num_encounters = %s" % self.num_encounters)
+                method_logger.log("Gau not found! num_encounters = %s", self.num_encounters)
                 self.force_additional_encounter(show_avoided=False)
-            method_logger.log("Gau found after %s extra encounters" % (self.num_encounters - starting_num_encounters))
+            method_logger.log("Gau found after %s extra encounters", self.num_encounters - starting_num_encounters)
 
         if self.scriptptr == Route.scriptlength:
             raise Exception("Script pointer out of bounds.")
         if debug:
-            self.travelog += self.debug_string
+            self.log_debug()
         instr = Route.script[self.scriptptr]
-        method_logger.log("Located instruction { scriptptr: %s, instruction: %s }" % (self.scriptptr, instr))
+        method_logger.log("Located instruction { scriptptr: %s, instruction: %s }", self.scriptptr, instr)
         self.scriptptr += 1
 
         if instr.restriction:
-            method_logger.log("Restriction instruction found { rtype: %s, value: %s }" % (instr.rtype if hasattr(instr, 'rtype') else None, instr.value if hasattr(instr, 'value') else None))
+            if ALLOW_DEBUG_LOGGING:
+                method_logger.log("Restriction instruction found { rtype: %s, value: %s }" % (instr.rtype if hasattr(instr, 'rtype') else None, instr.value if hasattr(instr, 'value') else None))
             if instr.value is None:
                 setattr(self, instr.rtype, 0)
             else:
                 value = getattr(self, instr.rtype)
                 if value < instr.value:
-                    method_logger.log("Restriction not met: { value: %s, required_value: %s }" % (value, instr.value))
+                    method_logger.log("Restriction not met: { value: %s, required_value: %s }", value, instr.value)
                     return False
                 else:
-                    method_logger.log("Restriction satisfied: { value: %s, required_value: %s }" % (value, instr.value))
+                    method_logger.log("Restriction satisfied: { value: %s, required_value: %s }", value, instr.value)
                     setattr(self, instr.rtype, 0)
         elif instr.travel:
-            method_logger.log("Travel instruction found { veldt: %s, avoidgau: %s, steps: %s, threatrate: %s, force_threat: %s, fset: %s }" % (
-                instr.veldt if hasattr(instr, 'veldt') else None,
-                instr.avoidgau if hasattr(instr, 'avoidgau') else None,
-                instr.steps if hasattr(instr, 'steps') else None,
-                instr.threatrate if hasattr(instr, 'threatrate') else None,
-                instr.force_threat if hasattr(instr, 'force_threat') else None,
-                instr.fset.log_string if hasattr(instr, 'fset') and instr.fset is not None else None
-            ))
+            if ALLOW_DEBUG_LOGGING:
+                method_logger.log("Travel instruction found { veldt: %s, avoidgau: %s, steps: %s, threatrate: %s, force_threat: %s, fset: %s }" % (
+                    instr.veldt if hasattr(instr, 'veldt') else None,
+                    instr.avoidgau if hasattr(instr, 'avoidgau') else None,
+                    instr.steps if hasattr(instr, 'steps') else None,
+                    instr.threatrate if hasattr(instr, 'threatrate') else None,
+                    instr.force_threat if hasattr(instr, 'force_threat') else None,
+                    instr.fset.log_string if hasattr(instr, 'fset') and instr.fset is not None else None
+                ))
             formations = self.predict_encounters(instr, debug=debug)
             if instr.veldt and not instr.avoidgau:
                 if instr.seek_rage:
-                    method_logger.log("Seeking a rage %s" % instr.seek_rage)
+                    method_logger.log("Seeking a rage %s", instr.seek_rage)
                     for f in formations:
                         if f.formid in instr.desired_formations:
                             break
@@ -520,46 +635,51 @@ class Route():
                         cost += self.veldt_up
                     if cost > 0:
                         self.cost += cost
-                        self.travelog += "*** VELDT PENALTY +%s ***\n" % cost
+                        self.log_event(LOG_VELDT_PENALTY, cost)
 
                 method_logger.log("Completed on veldt and not avoiding gau %s")
                 return True
         elif instr.event:
-            method_logger.log("Event instruction found { formation: %s, instruction: %s }" % (instr.formation, instr.log_string))
-            self.travelog += "EVENT: %s\n" % instr.formation
+            if ALLOW_DEBUG_LOGGING:
+                method_logger.log("Event instruction found { formation: %s, instruction: %s }" % (instr.formation, instr.log_string))
+            self.log_event(LOG_EVENT, instr.formation.formid)
             if instr.formation.formid < 0x200:
-                method_logger.log("Add formation to seend_formations: formation: %s" % instr.formation)
-                self.seen_formations.add(instr.formation.formid)
+                method_logger.log("Add formation to seend_formations: formation: %s", instr.formation)
+                self.seen_formations |= 1 << instr.formation.formid
             self.increment_battle(rng=True)
             self.overworld_threatrate = None
             method_logger.log("Zero overworld threat")
         elif instr.random:
-            method_logger.log("Random encounter instruction found { fset: %s, instruction: %s }" % (instr.fset, instr.log_string))
+            if ALLOW_DEBUG_LOGGING:
+                method_logger.log("Random encounter instruction found { fset: %s, instruction: %s }" % (instr.fset, instr.log_string))
             formation = self.predict_formation(instr.fset)
             self.xp += formation.xp
-            cost = formation.cost(self.weight, self.smokebombs)
+            cost = self.formation_cost(formation)
             self.cost += cost
-            self.travelog += "RANDOM EVENT: " + str(formation) + " COST: %s" % cost + "\n"
+            self.log_event(LOG_RANDOM, formation.formid, cost)
             self.overworld_threatrate = None
-            method_logger.log("Random encounter details: { cost: %s, xp: %s, formation: %s }" % (cost, formation.xp, formation))
+            method_logger.log("Random encounter details: { cost: %s, xp: %s, formation: %s }", cost, formation.xp, formation)
         elif instr.weight:
-            method_logger.log("Weight instruction found %s" % instr.weightval)
+            method_logger.log("Weight instruction found %s", instr.weightval)
             self.weight = instr.weightval
             #if self.weight <= 0.09:
             #    self.smokebombs = True
         elif instr.lete:
-            method_logger.log("Lete instruction found - noop here %s" % instr.log_string)
+            if ALLOW_DEBUG_LOGGING:
+                method_logger.log("Lete instruction found - noop here %s" % instr.log_string)
             return False
         elif instr.reset:
-            method_logger.log("Reset instruction found - noop here %s" % instr.log_string)
+            if ALLOW_DEBUG_LOGGING:
+                method_logger.log("Reset instruction found - noop here %s" % instr.log_string)
             return False
         elif instr.force:
-            method_logger.log("Force instruction found %s" % instr.log_string)
+            if ALLOW_DEBUG_LOGGING:
+                method_logger.log("Force instruction found %s" % instr.log_string)
             prevtrav = [i for i in self.script[:self.scriptptr] if i.travel][-1]
             instr.force_threat = prevtrav.force_threat
             instr.fset = prevtrav.fset
             instr.threatrate = prevtrav.threatrate
-            method_logger.log("Forcing additional encounter: { force_threat: %s, threatrate: %s, fset: %s }" % (instr.force_threat, instr.threatrate, instr.fset))
+            method_logger.log("Forcing additional encounter: { force_threat: %s, threatrate: %s, fset: %s }", instr.force_threat, instr.threatrate, instr.fset)
             self.force_additional_encounter()
             method_logger.log("Completed forcing additional encounter")
             return True
@@ -574,8 +694,9 @@ class Route():
         :param debug:
         :return:
         """
-        method_logger = MethodContextLogger("predict_encounters", self, instr)
-        method_logger.log("Start predict_encounters with { steps: %s, debug: %s, instr.steps: %s }" % (steps, debug, instr.steps if instr is not None and instr.steps is not None else None))
+        method_logger = context_logger("predict_encounters", self, instr)
+        if ALLOW_DEBUG_LOGGING:
+            method_logger.log("Start predict_encounters with { steps: %s, debug: %s, instr.steps: %s }" % (steps, debug, instr.steps if instr is not None and instr.steps is not None else None))
         # note: seed changes when RNG is called and counter is at 0xFF
         # battlecounter += 0x11
         # stepcounter += 0x17
@@ -583,34 +704,43 @@ class Route():
         steps = instr.steps if steps is None else steps
         self.boundary_flag = False
         if steps and hasattr(instr, "fset"):
-            method_logger.log("Instruction has fset %s" % instr.fset.log_string)
-            self.travelog += "%s threat steps in encounter zone %x.\n" % (steps, instr.fset.setid)
+            if ALLOW_DEBUG_LOGGING:
+                method_logger.log("Instruction has fset %s" % instr.fset.log_string)
+            self.log_event(LOG_ZONE, steps, instr.fset.setid)
 
         formations = []
         while True:
             if steps == 0:
-                method_logger.log("Return formations: %s" % str(formations))
+                if ALLOW_DEBUG_LOGGING:
+                    method_logger.log("Return formations: %s" % str(formations))
                 method_logger.log("End predict_encounters")
                 return formations
 
-            steps -= 1
-            taken += 1
-            total += 1
+            # jump straight to the step with the next battle, the steps before it only move the counters
+            threatrate = self.step_threatrate(instr)
+            battle_step = Route.steprng.steps_to_battle(self.stepcounter, self.stepseed, self.threat, threatrate, steps)
+            if battle_step is None:
+                self.walk(steps, threatrate)
+                steps = 0
+                continue
+            self.walk(battle_step - 1, threatrate)
+            steps -= battle_step
+            taken += battle_step
+            total += battle_step
 
             formation = self.take_a_step(instr, debug=debug)
-            if formation:
-                #self.travelog += "STEP %s: \n" % taken
-                #self.travelog += "%s\n" % self
-                #if steps <= 1:
-                if steps <= 3:
-                    self.cost += 0.1
-                    self.boundary_flag = True
-                #if taken <= 2:
-                if taken <= 4:
-                    self.cost += 0.1
-                taken = 0
-                formations.append(formation)
-                method_logger.log("Encountered formation { steps: %s, taken: %s, total: %s, formations.size: %s, formation: %s }" % (steps, taken, total, len(formations), formation))
+            #self.travelog += "STEP %s: \n" % taken
+            #self.travelog += "%s\n" % self
+            #if steps <= 1:
+            if steps <= 3:
+                self.cost += 0.1
+                self.boundary_flag = True
+            #if taken <= 2:
+            if taken <= 4:
+                self.cost += 0.1
+            taken = 0
+            formations.append(formation)
+            method_logger.log("Encountered formation { steps: %s, taken: %s, total: %s, formations.size: %s, formation: %s }", steps, taken, total, len(formations), formation)
 
     def take_a_step(self, instr, debug=True):
         """
@@ -619,28 +749,13 @@ class Route():
         :param debug:
         :return:
         """
-        method_logger = MethodContextLogger("take_a_step", self, instr)
+        method_logger = context_logger("take_a_step", self, instr)
         method_logger.log("Start take_a_step")
 
-        if instr.force_threat:
-            method_logger.log("force threat")
-            self.overworld_threatrate = instr.threatrate
-            threatrate = self.overworld_threatrate
-        elif instr.fset.overworld:
-            method_logger.log("fset.overworld=True")
-            if self.overworld_threatrate is None:
-                method_logger.log("overworld_threatrate is None")
-                self.overworld_threatrate = instr.threatrate
-            threatrate = self.overworld_threatrate
-            method_logger.log("resulting threatrate=%s" % threatrate)
-        else:
-            self.overworld_threatrate = None
-            threatrate = instr.threatrate
-            method_logger.log("not force threat or fset.overworld so threatrate=%s" % threatrate)
-
+        threatrate = self.step_threatrate(instr)
         self.cost += STEP_VALUE
         self.threat += threatrate
-        method_logger.log("increment cost by STEP_VALUE=%s and threat by threatrate=%s" % (STEP_VALUE, threatrate))
+        method_logger.log("increment cost by STEP_VALUE=%s and threat by threatrate=%s", STEP_VALUE, threatrate)
         if self.predict_battle():
             method_logger.log("Battle is predicted")
             # if instr.veldt: # commented out as it is no-op
@@ -651,37 +766,75 @@ class Route():
             #     '''
             #     logger.info("take_a_step: Veldt battle predicted for %s" % (route_instruction_log_string(self, instr)))
             self.num_encounters += 1
-            method_logger.log("Increment num_encounters to %d" % self.num_encounters)
+            method_logger.log("Increment num_encounters to %d", self.num_encounters)
             if instr.veldt:
                 formation = self.predict_veldt_formation()
                 if not instr.avoidgau:
                     self.gau_encounters += 1
-                method_logger.log("Veldt battle predicted. avoidgau=%s, gau_encounters=%s, formation=%s" % (instr.avoidgau, self.gau_encounters, formation))
+                method_logger.log("Veldt battle predicted. avoidgau=%s, gau_encounters=%s, formation=%s", instr.avoidgau, self.gau_encounters, formation)
             else:
                 formation = self.predict_formation(instr.fset)
-                method_logger.log("Not a veldt battle. formation=%s" % formation)
+                method_logger.log("Not a veldt battle. formation=%s", formation)
             self.xp += formation.xp
-            method_logger.log("Gained %s xp for total_xp=%s from formation=%s" % (formation.xp, self.xp, formation))
+            method_logger.log("Gained %s xp for total_xp=%s from formation=%s", formation.xp, self.xp, formation)
             if instr.veldt:
-                cost = formation.cost(self.weight, self.smokebombs, avoidgau=instr.avoidgau)
+                cost = self.formation_cost(formation, avoidgau=instr.avoidgau)
             else:
-                cost = formation.cost(self.weight, self.smokebombs)
+                cost = self.formation_cost(formation)
             self.cost += cost
-            method_logger.log("formation.cost=%s, route_current_cost=%s" % (cost, self.cost))
-            self.travelog += "ENCOUNTER: " + str(formation) + " COST: %s\n" % cost
+            method_logger.log("formation.cost=%s, route_current_cost=%s", cost, self.cost)
+            self.log_event(LOG_ENCOUNTER, formation.formid, cost)
             if debug:
-                debug_string = self.debug_string
-                self.travelog += debug_string
+                self.log_debug()
             self.threat = 0
             method_logger.log("Zero the threat")
             if not instr.veldt and instr.fset.overworld:
                 self.overworld_threatrate = instr.threatrate
-                method_logger.log("Set overworld_threatrate=%s" % self.overworld_threatrate)
+                method_logger.log("Set overworld_threatrate=%s", self.overworld_threatrate)
 
-            method_logger.log("Returning formation=%s" % formation)
+            method_logger.log("Returning formation=%s", formation)
             method_logger.log("End take_a_step")
             return formation
 
+    def formation_cost(self, formation, avoidgau=False):
+        """
+        :param formation: a Formation fought by this route
+        :param avoidgau: see Formation.cost
+        :return: formation.cost for this route's weight and smokebombs, looked up in formation.cost_table
+        """
+        return cost_table(self.weight, self.smokebombs, avoidgau)[formation.formid]
+
+    def step_threatrate(self, instr):
+        """
+        Works out the threat added by a step of the given travel instruction, updating the overworld threat rate.
+        The result only changes after a battle so it is constant for all the steps leading up to one.
+        :param instr: a travel instruction
+        :return: the threat rate for the next step
+        """
+        if instr.force_threat:
+            self.overworld_threatrate = instr.threatrate
+            return self.overworld_threatrate
+        elif instr.fset.overworld:
+            if self.overworld_threatrate is None:
+                self.overworld_threatrate = instr.threatrate
+            return self.overworld_threatrate
+        else:
+            self.overworld_threatrate = None
+            return instr.threatrate
+
+    def walk(self, steps, threatrate):
+        """
+        Takes steps which are known not to end in a battle, see StepRNG.steps_to_battle.
+        Step costs are still added one at a time so the floating point cost matches stepping one by one.
+        :param steps: the number of steps to take
+        :param threatrate: the threat rate for each of the steps
+        :return:
+        """
+        for _ in range(steps):
+            self.cost += STEP_VALUE
+        self.threat += steps * threatrate
+        self.stepcounter, self.stepseed = StepRNG.advance(self.stepcounter, self.stepseed, steps)
+
     @property
     def force_value(self):
         if self.last_forced_encounter is None:
@@ -711,8 +864,8 @@ class Route():
         :param show_avoided: compute and print the avoided encounters if true
         :return: a formation which will result from taking steps
         """
-        method_logger = MethodContextLogger("force_additional_encounter", self, Route.script[self.scriptptr])
-        method_logger.log("Start force_additional_encounter. show_avoided=%s" % show_avoided)
+        method_logger = context_logger("force_additional_encounter", self)
+        method_logger.log("Start force_additional_encounter. show_avoided=%s", show_avoided)
         if self.boundary_flag:
             method_logger.log("Boundary flag")
             self.cost += 0.9
@@ -720,61 +873,159 @@ class Route():
             method_logger.log("No boundary flag")
             self.cost += 1
         self.boundary_flag = False
-        self.travelog += "*** FORCE ADDITIONAL ENCOUNTER ***\n"
+        self.log_text("*** FORCE ADDITIONAL ENCOUNTER ***")
         if show_avoided:
-            parallel = self.copy()
-            parallel.travelog = ""
-            avoidance = None
-            method_logger.log("Made parallel copy with id %d" % parallel.id)
-            while True:
-                if parallel.scriptptr == Route.scriptlength:
-                    break
-
-                if not parallel.execute_script(debug=False):
-                    break
-
-                if "ENCOUNTER:" in parallel.travelog or "RANDOM EVENT:" in parallel.travelog:
-                    avoidance = parallel.travelog.strip().split('\n')[-1]
-                    assert avoidance
-                    avoidance = avoidance.replace("ENCOUNTER:", "AVOIDED:")
-                    avoidance = avoidance.replace("RANDOM EVENT:", "AVOIDED:")
-                    break
+            avoided = self.avoided_encounter()
 
         self.last_forced_encounter = self.num_encounters
-        step = 0
-        done = False
         instr = self.previous_instr
-        method_logger.log("Previous instruction %s" % instr.log_string if instr else None)
-        while True:
-            step += 1
-            method_logger.log("Step %d" % step)
-            if not done:
-                formation = self.take_a_step(instr)
-                method_logger.log("Formation %s" % formation)
-            else:
-                method_logger.log("Done and taking a step")
-                self.take_a_step(instr) # this takes a step after formation has happened ( maybe this is completing a step after the battle or something? )
-
-            if formation:
-                done = True
-
-            if done and (step & 1) == 0: # step & 1 -> I assume this means steps is odd?
-                method_logger.log("Break out as done and step %d & 1 == 0" % step)
-                break
-
-        if show_avoided and avoidance:
-            method_logger.log("Avoidance: %s" % avoidance)
-            self.travelog += avoidance + "\n"
-
-        method_logger.log("Returning formation: %s" % formation)
+        if ALLOW_DEBUG_LOGGING:
+            method_logger.log("Previous instruction %s" % instr.log_string if instr else None)
+        # keep walking until a battle happens, then finish on an even number of steps
+        threatrate = self.step_threatrate(instr)
+        step = Route.steprng.steps_to_battle(self.stepcounter, self.stepseed, self.threat, threatrate)
+        self.walk(step - 1, threatrate)
+        formation = self.take_a_step(instr)
+        method_logger.log("Formation %s after %d steps", formation, step)
+        if step & 1:
+            method_logger.log("Taking a step to finish on an even step")
+            self.take_a_step(instr) # this takes a step after formation has happened ( maybe this is completing a step after the battle or something? )
+
+        if show_avoided and avoided is not None:
+            avoidance = render_event((None,) + avoided, Route.formations)
+            avoidance = avoidance.replace("ENCOUNTER:", "AVOIDED:")
+            avoidance = avoidance.replace("RANDOM EVENT:", "AVOIDED:")
+            method_logger.log("Avoidance: %s", avoidance)
+            self.log_text(avoidance)
+
+        method_logger.log("Returning formation: %s", formation)
         method_logger.log("End force_additional_encounter")
         return formation
 
+    def avoided_encounter(self):
+        """
+        Works out the battle this route would run into next if it did not force an encounter, for the AVOIDED line of
+        force_additional_encounter. Results of lookahead are memoised in Route.lookaheads.
+        :return: the last travel log event of the first instruction with a battle as ( kind, *args ) without its
+                 parent, None if the route ends or fails first
+        """
+        key = (self.scriptptr, self.stepcounter, self.stepseed, self.battlecounter, self.battleseed, self.threat,
+               self.overworld_threatrate)
+        if key in Route.lookaheads:
+            lookahead = Route.lookaheads[key]
+        else:
+            lookahead = self.lookahead()
+            if len(Route.lookaheads) >= Route.maxlookaheads:
+                Route.lookaheads.clear()
+            Route.lookaheads[key] = lookahead
+        if lookahead is None:
+            return self.simulate_avoided_encounter()
+
+        xp_needed, kind, formid, weight = lookahead
+        if kind is None or self.xp < xp_needed:
+            return None
+        if weight is None:
+            weight = self.weight
+        return kind, formid, cost_table(weight, self.smokebombs)[formid]
+
+    def lookahead(self):
+        """
+        Follows the script from this route's state to the first instruction with a battle without copying the route.
+        Restrictions, events, random encounters, weight changes and travel outside of the veldt only depend on the rng
+        state, threat and overworld threat rate, and on the route's xp through the first xp restriction.
+        :return: ( xp needed, kind, formid, weight ) where kind and formid are those of the last battle of that
+                 instruction, kind is None if the route ends or fails before a battle, xp needed is the xp the first
+                 restriction asks for and weight is None if it is still the route's weight. None if an instruction
+                 which depends on more of the route's state comes first, see simulate_avoided_encounter
+        """
+        stepcounter, stepseed = self.stepcounter, self.stepseed
+        battlecounter, battleseed = self.battlecounter, self.battleseed
+        threat = self.threat
+        overworld_threatrate = self.overworld_threatrate
+        xp_needed = 0
+        xp_reset = False # True once a restriction set the route's xp to 0
+        weight = None
+        for scriptptr in range(self.scriptptr, Route.scriptlength):
+            previous = Route.script[scriptptr - 1] if scriptptr > 0 else None
+            if previous is not None and previous.veldt and not previous.avoidgau:
+                return None
+            instr = Route.script[scriptptr]
+            if instr.restriction:
+                if instr.rtype != "xp":
+                    return None
+                if instr.value is not None:
+                    if not xp_reset:
+                        xp_needed = instr.value
+                    elif instr.value > 0:
+                        return xp_needed, None, None, None
+                xp_reset = True
+            elif instr.travel:
+                if instr.veldt:
+                    return None
+                # predict_encounters without the costs
+                formid = None
+                steps = instr.steps
+                while steps:
+                    if instr.force_threat:
+                        overworld_threatrate = threatrate = instr.threatrate
+                    elif instr.fset.overworld:
+                        if overworld_threatrate is None:
+                            overworld_threatrate = instr.threatrate
+                        threatrate = overworld_threatrate
+                    else:
+                        overworld_threatrate = None
+                        threatrate = instr.threatrate
+                    battle_step = Route.steprng.steps_to_battle(stepcounter, stepseed, threat, threatrate, steps)
+                    if battle_step is None:
+                        stepcounter, stepseed = StepRNG.advance(stepcounter, stepseed, steps)
+                        threat += steps * threatrate
+                        break
+                    stepcounter, stepseed = StepRNG.advance(stepcounter, stepseed, battle_step)
+                    steps -= battle_step
+                    battlecounter, battleseed = BattleRNG.advance(battlecounter, battleseed)
+                    slot = Route.battlerng.slot(battlecounter, battleseed, len(instr.fset.formations))
+                    formid = instr.fset.formations[slot].formid
+                    threat = 0
+                    if instr.fset.overworld:
+                        overworld_threatrate = instr.threatrate
+                if formid is not None:
+                    return xp_needed, LOG_ENCOUNTER, formid, weight
+            elif instr.event:
+                battlecounter, battleseed = BattleRNG.advance(battlecounter, battleseed)
+                overworld_threatrate = None
+            elif instr.random:
+                battlecounter, battleseed = BattleRNG.advance(battlecounter, battleseed)
+                slot = Route.battlerng.slot(battlecounter, battleseed, len(instr.fset.formations))
+                return xp_needed, LOG_RANDOM, instr.fset.formations[slot].formid, weight
+            elif instr.weight:
+                weight = instr.weightval
+            elif instr.lete or instr.reset:
+                return xp_needed, None, None, None
+            elif instr.force:
+                return None
+        return xp_needed, None, None, None
+
+    def simulate_avoided_encounter(self):
+        """
+        Runs a copy of the route forward without forcing an encounter up to the first instruction with a battle
+        :return: see avoided_encounter
+        """
+        parallel = self.copy()
+        while parallel.scriptptr < Route.scriptlength:
+            # only the events of the instruction being run are kept, earlier instructions had no battles
+            parallel.log_tail = None
+            if not parallel.execute_script(debug=False):
+                return None
+            if any(e[1] in (LOG_ENCOUNTER, LOG_RANDOM) for e in iter_events(parallel.log_tail)):
+                return parallel.log_tail[1:]
+        return None
+
     @property
     def heuristic(self):
         #return (self.num_encounters << 16) + self.cost + (self.threat >> 12)
         # Note that self.threat appears to always have value 0 at runtime so heuristic returns cost at the moment
-        return self.cost + (self.threat >> 12)
+        # plus the lower bound of the cost still to come, see remaining_cost_bounds
+        return self.cost + (self.threat >> 12) + Route.lowerbounds[self.scriptptr]
 
         '''
         tempthreat = self.threat
@@ -805,46 +1056,47 @@ class Route():
 
     @property
     def reset_value(self):
-        method_logger = MethodContextLogger("reset_value", self)
-        method_logger.log("Start reset_value { num_encounters: %s, last_reset: %s }" % (self.num_encounters, self.last_reset))
+        method_logger = context_logger("reset_value", self)
+        method_logger.log("Start reset_value { num_encounters: %s, last_reset: %s }", self.num_encounters, self.last_reset)
         if self.last_reset is None:
             return None
         diff = self.num_encounters - self.last_reset
-        method_logger.log("Returning difference: %s" % diff)
+        method_logger.log("Returning difference: %s", diff)
         method_logger.log("End reset_value")
         return diff
 
     def reset_one(self):
-        method_logger = MethodContextLogger("reset_one", self, Route.script[self.scriptptr])
-        method_logger.log("Start reset_one { cost: %s, seed: %s }" % (self.cost, self.seed))
+        method_logger = context_logger("reset_one", self)
+        method_logger.log("Start reset_one { cost: %s, seed: %s }", self.cost, self.seed)
         if JAPAN:
             self.cost += 10
         else:
             self.cost += 25
         self.set_seed(self.seed+1)
-        method_logger.log("End reset_one { cost: %s, seed: %s }" % (self.cost, self.seed))
-        self.travelog += "*** RESET TO GAME LOAD SCREEN ***\n"
+        method_logger.log("End reset_one { cost: %s, seed: %s }", self.cost, self.seed)
+        self.log_text("*** RESET TO GAME LOAD SCREEN ***")
 
     def reset_fourteen(self):
-        method_logger.log("Start reset_fourteen { cost: %s, seed: %s, last_reset: %s }" % (self.cost, self.seed, self.last_reset))
+        method_logger = context_logger("reset_fourteen", self)
+        method_logger.log("Start reset_fourteen { cost: %s, seed: %s, last_reset: %s }", self.cost, self.seed, self.last_reset)
         if JAPAN:
             self.cost += 15
         else:
             self.cost += 30
         self.set_seed(self.seed+14)
         self.last_reset = self.num_encounters
-        method_logger.log("End reset_fourteen { cost: %s, seed: %s, last_reset: %s }" % (self.cost, self.seed, self.last_reset))
-        self.travelog += "*** RELOAD ***\n"
+        method_logger.log("End reset_fourteen { cost: %s, seed: %s, last_reset: %s }", self.cost, self.seed, self.last_reset)
+        self.log_text("*** RELOAD ***")
 
     def menu_reset_threatrate(self):
-        method_logger = MethodContextLogger("menu_reset_threatrate", self, Route.script[self.scriptptr])
+        method_logger = context_logger("menu_reset_threatrate", self)
         self.cost += 1
         instr = Route.script[self.scriptptr]
-        method_logger.log("Start menu_reset_threatrate { cost: %s, overworld_threatrate: %s, instr.threatrate: %s }" % (self.cost, self.overworld_threatrate, instr.threatrate))
+        method_logger.log("Start menu_reset_threatrate { cost: %s, overworld_threatrate: %s, instr.threatrate: %s }", self.cost, self.overworld_threatrate, instr.threatrate)
         assert instr.fset.overworld
         self.overworld_threatrate = instr.threatrate
-        self.travelog += "*** OPEN MENU TO RESET THREAT RATE ***\n"
-        method_logger.log("End menu_reset_threatrate { cost: %s, overworld_threatrate: %s, instr.threatrate: %s }" % (self.cost, self.overworld_threatrate, instr.threatrate))
+        self.log_text("*** OPEN MENU TO RESET THREAT RATE ***")
+        method_logger.log("End menu_reset_threatrate { cost: %s, overworld_threatrate: %s, instr.threatrate: %s }", self.cost, self.overworld_threatrate, instr.threatrate)
 
     def expand(self):
         """
@@ -855,7 +1107,7 @@ class Route():
         In usage this always returns 1 or 2 nodes
         :return:
         """
-        method_logger = MethodContextLogger("expand", self, Route.script[self.scriptptr])
+        method_logger = context_logger("expand", self)
         method_logger.log("Start expand")
         if self.scriptptr == 24:
             method_logger.log("Script pointer is 24")
@@ -866,7 +1118,7 @@ class Route():
         instr = Route.script[self.scriptptr]
         if instr.veldt:
             method_logger.log("Entering veldt")
-            self.travelog += "*** ENTER THE VELDT ***\n"
+            self.log_text("*** ENTER THE VELDT ***")
             '''
             self.travelog += "%x %x %x %x %x\n" % (
                 self.stepseed, self.stepcounter, self.battleseed,
@@ -878,20 +1130,24 @@ class Route():
                 and self.previous_instr.steps >= 2):
             # force encounter
             distance = self.force_value
-            method_logger.log("Instruction has previous travel instruction with steps > 2. distance=%s, previous_instruction=%s" % (self.force_value, self.previous_instr.log_string))
+            if ALLOW_DEBUG_LOGGING:
+                method_logger.log("Instruction has previous travel instruction with steps > 2. distance=%s, previous_instruction=%s" % (self.force_value, self.previous_instr.log_string))
             if distance is not None and distance < 2:
                 pass
             elif self.scriptptr < (Route.scriptlength-1):
                 child = self.copy()
-                method_logger.log("Made child copy %s" % child.short_string)
+                if ALLOW_DEBUG_LOGGING:
+                    method_logger.log("Made child copy %s" % child.short_string)
                 if child.force_additional_encounter():
                     if child.execute_script():
-                        method_logger.log("execute_script was true for child copy %s" % child.short_string)
+                        if ALLOW_DEBUG_LOGGING:
+                            method_logger.log("execute_script was true for child copy %s" % child.short_string)
                         children.append(child)
                     #children.append(child)
 
         if instr.travel and hasattr(instr, 'fset'):
-            method_logger.log("Travel instruction hasAttr fset %s" % instr.fset.log_string)
+            if ALLOW_DEBUG_LOGGING:
+                method_logger.log("Travel instruction hasAttr fset %s" % instr.fset.log_string)
             if (self.overworld_threatrate and instr.fset.overworld and
                     self.overworld_threatrate > instr.threatrate and
                     not instr.force_threat):
@@ -901,12 +1157,13 @@ class Route():
                 # in order to reset/correct the threat rate ie: to force an encounter between phantom train and piranha fight before veldt
                 # change threat rate
                 child = self.copy()
-                method_logger.log("Child copy made while resetting overworld threat %s" % child.log_string)
+                if ALLOW_DEBUG_LOGGING:
+                    method_logger.log("Child copy made while resetting overworld threat %s" % child.log_string)
                 child.menu_reset_threatrate()
                 children.append(child)
 
             distance = self.reset_value or 0
-            method_logger.log("Distance: %s" %distance)
+            method_logger.log("Distance: %s", distance)
             if self.previous_instr.travel:
                 method_logger.log("Previous instruction was travel")
                 if (self.previous_instr.threatrate < instr.threatrate and
@@ -917,9 +1174,9 @@ class Route():
                             continue
 
                         child = self.copy()
-                        child.travelog += "*** TAKE %s EXTRA STEPS ***\n" % steps
+                        child.log_event(LOG_EXTRA_STEPS, steps)
                         formations = child.predict_encounters(self.previous_instr, steps=steps)
-                        method_logger.log("Predicted formations %s" % formations)
+                        method_logger.log("Predicted formations %s", formations)
                         if not formations:
                             parallel1 = self.copy()
                             parallel2 = child.copy()
@@ -929,7 +1186,8 @@ class Route():
                                 break
 
                             if len(formations1) > len(formations2) and child.execute_script():
-                                method_logger.log("Appending child: %s" % child.log_string)
+                                if ALLOW_DEBUG_LOGGING:
+                                    method_logger.log("Appending child: %s" % child.log_string)
                                 children.append(child)
 
                 if ((self.overworld_threatrate and not instr.fset.overworld) or
@@ -942,7 +1200,8 @@ class Route():
                     #     children.extend(resetted)
 
         if instr.lete:
-            method_logger.log("Lete instruction found %s" % instr.log_string)
+            if ALLOW_DEBUG_LOGGING:
+                method_logger.log("Lete instruction found %s" % instr.log_string)
             #DESIRED_FORMATIONS = set([0x14, 0x15, 0x16, 0x18])
             #caught = len(DESIRED_FORMATIONS & self.seen_formations)
             #if caught == 0:
@@ -950,13 +1209,13 @@ class Route():
             #if caught >= 2:
             #    self.veldt_up = 10 * (caught-1)
             #    self.cost -= self.veldt_up
-            self.travelog += "*** GO TO RETURNER SAVE POINT ***\n"
+            self.log_text("*** GO TO RETURNER SAVE POINT ***")
             resetted = get_reset_bunch(self)
             for node in resetted:
                 child = node.copy()
                 #if child.get_best_river(battles=1) and child.execute_script():
                 if child.get_best_river(battles=0) and child.execute_script():
-                    method_logger.log("Adding best river child %s" % child)
+                    method_logger.log("Adding best river child %s", child)
                     children.append(child)
                 # The commented code below in this for loop was previously uncommented but unreachable so this is
                 # identical functionality but a little less confusing. Left commented in case it should be added back in at some point
@@ -966,10 +1225,11 @@ class Route():
                 # if child.get_best_river(battles=1) and child.execute_script():
                 #     children.append(child)
         elif instr.reset:
-            method_logger.log("Reset instruction found %s" % instr.log_string)
+            if ALLOW_DEBUG_LOGGING:
+                method_logger.log("Reset instruction found %s" % instr.log_string)
             children = []
             resetted = get_reset_bunch(self, ones=13, fourteens=5)
-            method_logger.log("Processing resetted %s" % resetted)
+            method_logger.log("Processing resetted %s", resetted)
             for node in resetted:
                 child = node.copy()
                 child.execute_script()
@@ -978,19 +1238,23 @@ class Route():
             instr.force_threat = self.previous_instr.force_threat
             instr.fset = self.previous_instr.fset
             instr.threatrate = self.previous_instr.threatrate
-            method_logger.log("Force instruction found { force_threat: %s, threatrate: %s, fset: %s, instruction: %s}" % (
-                instr.force_threat,
-                instr.threatrate,
-                instr.fset,
-                instr.log_string))
+            if ALLOW_DEBUG_LOGGING:
+                method_logger.log("Force instruction found { force_threat: %s, threatrate: %s, fset: %s, instruction: %s}" % (
+                    instr.force_threat,
+                    instr.threatrate,
+                    instr.fset,
+                    instr.log_string))
             self.force_additional_encounter()
-            method_logger.log("Finished force additional encounter and appending self %s" % self.log_string)
+            if ALLOW_DEBUG_LOGGING:
+                method_logger.log("Finished force additional encounter and appending self %s" % self.log_string)
             children.append(self)
         elif self.execute_script():
-            method_logger.log("Executed script and appending %s" % self.log_string)
+            if ALLOW_DEBUG_LOGGING:
+                method_logger.log("Executed script and appending %s" % self.log_string)
             children.append(self)
 
-        method_logger.log("Returning expanded children %s" % str(list(map(lambda x: x.short_string, children))) if children else None)
+        if ALLOW_DEBUG_LOGGING:
+            method_logger.log("Returning expanded children %s" % str(list(map(lambda x: x.short_string, children))) if children else None)
         method_logger.log("End expand")
         return children
 
@@ -1040,7 +1304,10 @@ class Instruction():
 
     @property
     def type(self):
-        if (self.travel):
+        if (self.veldt):
+            # veldt instructions are also travel instructions
+            return "veldt"
+        elif (self.travel):
             return "travel"
         elif (self.event):
             return "event"
@@ -1052,14 +1319,12 @@ class Instruction():
             return "weight"
         elif (self.random):
             return "random"
-        elif (self.veldt):
-            return "veldt"
         elif (self.reset):
             return "reset"
         elif (self.force):
             return "force"
         else:
-            "unknown"
+            return "unknown"
 
     @property
     def log_string(self):
@@ -1111,9 +1376,7 @@ class Instruction():
         self.avoidgau = False
         if desired_rage is not None:
             self.seek_rage = True
-            formations = [f.formid for f in Route.formations.values()
-                          if desired_rage in f.present_enemy_ids]
-            self.desired_formations = formations
+            self.desired_formations = list(enemy_formations.get(desired_rage, []))
         else:
             self.seek_rage = False
 
@@ -1147,9 +1410,11 @@ class Instruction():
 
     @property
     def best_encounter(self):
-        return min(self.fset.formations, key=lambda f: f.cost())
+        costs = cost_table()
+        return min(self.fset.formations, key=lambda f: costs[f.formid])
 
-def encounter_search(routes, number=1, anynode=True, maxsize=25000):
+def encounter_search(routes, number=1, anynode=True, maxsize=25000, report=None, stats=None, checkpoint=None,
+                     resume=None, expanded=0):
     """
     For fixed seed value, routes will have size 1. For all seeds will have size 255.
     TODO: add more documentation
@@ -1157,119 +1422,206 @@ def encounter_search(routes, number=1, anynode=True, maxsize=25000):
     :param number: the number of solutions to make
     :param anynode: always false at runtime
     :param maxsize: the max allowed priority queue size
-    :return:
+    :param report: a report.Report which each solution is written to as soon as it is found instead of being returned
+    :param stats: a searchstats.SearchStats which counts where the search spends its effort, None to not count
+    :param checkpoint: a checkpoint.Checkpoint which the search is saved to every so often, None to not save it
+    :param resume: the state returned by checkpoint.Checkpoint.load to carry on from instead of starting from routes
+    :param expanded: the expansions already made to get routes where they are, returned by initial_routes, so the
+                     fringe is pruned at the same points as if the search had made them
+    :return: list of solutions, empty if they were written to report
     """
-    fringe = PriorityQueue()
-    method_logger = MethodContextLogger("encounter_search")
+    def finish():
+        if stats is not None:
+            stats.finish(counter, transpositions.merged)
+        if checkpoint is not None:
+            checkpoint.remove()
+
+    method_logger = context_logger("encounter_search")
     method_logger.log("Start encounter_search")
-    method_logger.log("Searching %s routes to make %s solutions anyNode=%s, maxsize=%s, Route.scriptlength=%s" % (len(routes), number, anynode, maxsize, Route.scriptlength))
-    for r in routes:
-        method_logger.log("Add %s to priority queue " % r.short_string)
-        fringe.put((r.heuristic, r))
-
-    method_logger.log("Initial priority queue size is %d" % fringe.qsize())
-    counter = 0
-    progress = 0
-    highest = 0
-    solutions = []
-    while len(solutions) < number:
+    if resume is None:
+        fringe = Fringe()
+        transpositions = TranspositionTable(Route.script)
+        method_logger.log("Searching %s routes to make %s solutions anyNode=%s, maxsize=%s, Route.scriptlength=%s", len(routes), number, anynode, maxsize, Route.scriptlength)
+        for r in routes:
+            if ALLOW_DEBUG_LOGGING:
+                method_logger.log("Add %s to priority queue " % r.short_string)
+            p = r.heuristic
+            if transpositions.admit(r, p):
+                fringe.push(r, p)
+            elif stats is not None:
+                stats.prune("merged")
+
+        method_logger.log("Initial priority queue size is %d", len(fringe))
+        counter = expanded
+        if len(fringe) == 0:
+            # every route failed a restriction in lockstep before the search could branch
+            finish()
+            raise NoSolutionsError("No valid solutions found.")
+        progress = 0
+        highest = 0
+        solutions = []
+        found = 0
+        seed_solutions = {} # initialseed -> number of solutions found for it
+    else:
+        fringe = resume["fringe"]
+        transpositions = resume["transpositions"]
+        solutions = resume["solutions"]
+        counter, progress, highest, found, seed_solutions = resume["counters"]
+        method_logger.log("Resuming with priority queue size %d after %d nodes", len(fringe), counter)
+    while found < number:
+        p, node = fringe.pop()
+        if transpositions.superseded_route(node):
+            if ALLOW_DEBUG_LOGGING:
+                method_logger.log("Skipping %s, a cheaper route reached the same state" % node.short_string)
+            if stats is not None:
+                stats.prune("superseded")
+            if len(fringe) == 0:
+                if not found:
+                    finish()
+                    raise NoSolutionsError("No valid solutions found.")
+                break
+            continue
         counter += 1
-        p, node = fringe.get()
         highest = max(highest, node.scriptptr)
         method_logger.route = node
-        method_logger.log("{ counter: %s, max_script_ptr: %s, total_script_length: %s, selected: %s }" % (counter, highest, Route.scriptlength, node.short_string))
-        method_logger.lqueue(node, fringe.qsize(), fringe.queue)
+        if ALLOW_DEBUG_LOGGING:
+            method_logger.log("{ counter: %s, max_script_ptr: %s, total_script_length: %s, selected: %s }" % (counter, highest, Route.scriptlength, node.short_string))
+        method_logger.lqueue(node, len(fringe), fringe.queue)
         if node.scriptptr == Route.scriptlength:
-            if anynode or len([s for s in solutions if s.initialseed == node.initialseed]) < 2:
-                method_logger.log("Appending solution %s" % node.short_string)
-                solutions.append(node)
+            if anynode or seed_solutions.get(node.initialseed, 0) < 2:
+                if ALLOW_DEBUG_LOGGING:
+                    method_logger.log("Appending solution %s" % node.short_string)
+                found += 1
+                seed_solutions[node.initialseed] = seed_solutions.get(node.initialseed, 0) + 1
+                if report is None:
+                    solutions.append(node)
+                else:
+                    report.write(node)
+            elif stats is not None:
+                stats.prune("extra_solution")
 
-            if fringe.qsize() == 0:
+            if len(fringe) == 0:
                 method_logger.log("Breaking out as queue is empty")
                 break
             else:
-                method_logger.log("Continuing on as queue has size %d" % fringe.qsize())
+                method_logger.log("Continuing on as queue has size %d", len(fringe))
                 continue
 
         childCount = 0
-        for child in node.expand():
+        if stats is None:
+            children = node.expand()
+        else:
+            kind = Route.script[node.scriptptr].type
+            start = perf_counter()
+            children = node.expand()
+            seconds = perf_counter() - start
+        for child in children:
             childCount += 1
-            method_logger.log("Adding expanded child %d to queue %s" % (childCount, child.log_string))
-            fringe.put((child.heuristic, child))
+            p = child.heuristic
+            if transpositions.admit(child, p):
+                if ALLOW_DEBUG_LOGGING:
+                    method_logger.log("Adding expanded child %d to queue %s" % (childCount, child.log_string))
+                fringe.push(child, p)
+            else:
+                if ALLOW_DEBUG_LOGGING:
+                    method_logger.log("Merged expanded child %d into a route with the same state %s" % (childCount, child.log_string))
+                if stats is not None:
+                    stats.prune("merged")
 
-        method_logger.log("Expanded %d nodes" % childCount)
+        method_logger.log("Expanded %d nodes", childCount)
+        if stats is not None:
+            stats.expanded(node, kind, seconds, childCount, len(fringe))
 
         if not (counter % 1000):
-            method_logger.log("Counter value %d mod 1000 == 0 for queue size %d" % (counter, fringe.qsize()))
-            size = fringe.qsize()
+            method_logger.log("Counter value %d mod 1000 == 0 for queue size %d", counter, len(fringe))
+            if stats is not None:
+                stats.sample(counter, len(fringe), highest)
+            transpositions.forget_before(fringe.lowest_scriptptr())
+            size = len(fringe)
             nextsize = size
             while nextsize > maxsize:
                 progress += 1 # TODO: is this right? we are not guaranteed to have always processed the same amount of script items for any given node as times through the encounter_search while loop
                 print("%s/%s/%s" % (progress, highest, Route.scriptlength))
-                method_logger.log("nextsize %d > maxsize %d for progress=%d, highest=%d, scriptlength=%d" % (nextsize, maxsize, progress, highest, Route.scriptlength))
-                newfringe = PriorityQueue()
+                method_logger.log("nextsize %d > maxsize %d for progress=%d, highest=%d, scriptlength=%d", nextsize, maxsize, progress, highest, Route.scriptlength)
+                seeds = fringe.prunable_seeds(progress)
+                if not seeds:
+                    method_logger.log("No seed has 3 routes with 2 before progress=%d, nothing to prune", progress)
+                    continue
                 seen_seeds = set([])
                 seen_sigs = set([])
                 toggler = [False] * 0x100 # list of 256 False items ie: [False, False, False, ...] size == 256
-                seencount = 0
-                fringesize = fringe.qsize()
-                method_logger.log("{ seen_count: %d, seend_seeds: %s, seen_signatures: %s }" % (seencount, str(seen_seeds), str(seen_sigs)))
-                while fringe.qsize() > 0:
-                    p, node = fringe.get() # we know we are working in order of least cost
-                    seencount += 1
-                    signature = (node.initialseed, node.scriptptr)
-                    method_logger.route = node
-                    method_logger.log("Processing if node should remain in queue")
-                    if (node.scriptptr >= progress or
-                            node.initialseed not in seen_seeds or
-                            (node.scriptptr >= progress * 0.5 and
-                             signature not in seen_sigs)): # in order of least cost so this picks the route with less cost for that signature
-                        newfringe.put((p, node))
-                        seen_sigs.add(signature)
-                        seen_seeds.add(node.initialseed)
-                        method_logger.log("Selected %s with signature=%s for new queue" % (node.short_string, signature))
-                    elif (toggler[node.initialseed] is False # allows saving up to 2 of the same seed
-                            or (node.scriptptr == highest
-                                and seencount < fringesize / 2)): # either this is the furthest progress in the script OR in the first half of the priority queue ie: top 50% of routes by cost
-                        newfringe.put((p, node))
-                        seen_sigs.add(signature)
-                        seen_seeds.add(node.initialseed)
-                        toggler[node.initialseed] = True
-                        method_logger.log(
-                            "Selected %s because %s with signature=%s for new queue" % (
-                                node.short_string,
-                                "toggler " if highest != node.scriptptr else "highest",
-                                signature))
-                    else:
-                        toggler[node.initialseed] = False # means the next one of that seed in the queue would be allowed?
-                        method_logger.log("Deleting node! signature=%s, %s" % (signature, node.short_string))
-                        del(node)
-                del(fringe)
-                fringe = newfringe
-                nextsize = fringe.qsize()
+                fringesize = len(fringe)
+                if ALLOW_DEBUG_LOGGING:
+                    method_logger.log("{ seeds: %s, seend_seeds: %s, seen_signatures: %s }" % (str(seeds), str(seen_seeds), str(seen_sigs)))
+                dropped = []
+                # every route of the other seeds is kept, see Fringe.prunable_seeds, and each seed is decided on its own
+                for seed in seeds:
+                    for entry in fringe.seed_entries(seed): # we know we are working in order of least cost
+                        p, order, node = entry
+                        signature = (node.initialseed, node.scriptptr)
+                        method_logger.route = node
+                        method_logger.log("Processing if node should remain in queue")
+                        if (node.scriptptr >= progress or
+                                node.initialseed not in seen_seeds or
+                                (node.scriptptr >= progress * 0.5 and
+                                 signature not in seen_sigs)): # in order of least cost so this picks the route with less cost for that signature
+                            seen_sigs.add(signature)
+                            seen_seeds.add(node.initialseed)
+                            if ALLOW_DEBUG_LOGGING:
+                                method_logger.log("Selected %s with signature=%s for new queue" % (node.short_string, signature))
+                        elif (toggler[node.initialseed] is False # allows saving up to 2 of the same seed
+                                or (node.scriptptr == highest
+                                    and fringe.rank(entry) + 1 < fringesize / 2)): # either this is the furthest progress in the script OR in the first half of the priority queue ie: top 50% of routes by cost
+                            seen_sigs.add(signature)
+                            seen_seeds.add(node.initialseed)
+                            toggler[node.initialseed] = True
+                            if ALLOW_DEBUG_LOGGING:
+                                method_logger.log(
+                                    "Selected %s because %s with signature=%s for new queue" % (
+                                        node.short_string,
+                                        "toggler " if highest != node.scriptptr else "highest",
+                                        signature))
+                        else:
+                            toggler[node.initialseed] = False # means the next one of that seed in the queue would be allowed?
+                            if ALLOW_DEBUG_LOGGING:
+                                method_logger.log("Deleting node! signature=%s, %s" % (signature, node.short_string))
+                            if stats is not None:
+                                stats.prune("behind" if node.scriptptr < progress * 0.5 else "same_signature")
+                            transpositions.forget(node)
+                            dropped.append(entry)
+                fringe.remove(dropped)
+                nextsize = len(fringe)
             if nextsize != size:
                 print(highest, size, nextsize)
-                method_logger.log("Highest: %s. Reduced the queue size from %d to %d" % (highest, size, nextsize))
+                method_logger.log("Highest: %s. Reduced the queue size from %d to %d", highest, size, nextsize)
             else:
                 print(highest, nextsize)
-                method_logger.log("highest %s. nextsize still equal to size %d" % (highest, size))
+                method_logger.log("highest %s. nextsize still equal to size %d", highest, size)
             print(child.scriptlength - child.scriptptr)
-        if fringe.qsize() == 0:
+            if checkpoint is not None and len(fringe) and checkpoint.due():
+                checkpoint.save(fringe, transpositions, (counter, progress, highest, found, seed_solutions),
+                                solutions, Route, report)
+        if len(fringe) == 0:
             method_logger.log("ERROR NO VALID SOLUTIONS FOUND!")
-            raise Exception("No valid solutions found.")
+            finish()
+            raise NoSolutionsError("No valid solutions found.")
 
     seeds = set([])
     select_order = 0
-    while fringe.qsize() > 0:
+    for p, node in fringe.pop_many():
         select_order += 1
-        p, node = fringe.get()
         seeds.add(str(node.initialseed))
-        method_logger.log("{ selected: %s, order: %d, initial_seed: %d, full: %s }" % (node.short_string, select_order, node.initialseed, node.log_string))
+        if ALLOW_DEBUG_LOGGING:
+            method_logger.log("{ selected: %s, order: %d, initial_seed: %d, full: %s }" % (node.short_string, select_order, node.initialseed, node.log_string))
 
-    method_logger.log("ALL SEEDS: %s" % " ".join(sorted(seeds)))
+    if ALLOW_DEBUG_LOGGING:
+        method_logger.log("ALL SEEDS: %s" % " ".join(sorted(seeds)))
     print("ALL SEEDS: %s" % " ".join(sorted(seeds)))
-    method_logger.log("%s NODES EXPANDED" % counter)
+    method_logger.log("%s NODES EXPANDED", counter)
     print("%s NODES EXPANDED" % counter)
+    method_logger.log("%s ROUTES MERGED", transpositions.merged)
+    print("%s ROUTES MERGED" % transpositions.merged)
+    finish()
     return solutions
 
 
@@ -1286,7 +1638,7 @@ def map_routes_to_log_strings(iter):
             if isinstance(r, Route):
                 result.append(r.log_string)
             elif isinstance(r, tuple):
-                result.append(r[1].log_string)
+                result.append(r[-1].log_string)
     return result
 
 
@@ -1387,19 +1739,8 @@ def format_script(fsets, formations, filename):
         Route.script.append(i)
     Route.travelscript = [i for i in Route.script if i.travel]
     Route.scriptlength = len(Route.script)
+    Route.lookaheads = {}
 
-    sequence = open("tables/leteriver.txt").readlines()
-    sequence = [s.strip() for s in sequence]
-    sequence = [True if s == "fight" else False for s in sequence]
-    assert len(sequence) == 0x100
-    Route.riversequence = {}
-    for i in range(0x100):
-        subseq = [True, True] + sequence[i:i+7]
-        Route.riversequence[i] = subseq
-
-    Route.leterng = table_from_file("tables/leterng.txt", hexify=True)
-    assert 2 in Route.leterng
-    Route.returnerrng = table_from_file("tables/returnerrng.txt", hexify=True)
     Route.veldtpacks = {}
     for i in range(64):
         a = i * 8
@@ -1410,33 +1751,269 @@ def format_script(fsets, formations, filename):
             if any(e for e in formation.present_enemies if e.id > 0xFF):
                 Route.veldtpacks[i][j] = None
         assert len(Route.veldtpacks[i]) == 8
+    Route.veldtmasks = dict((i, sum(1 << j for j, formid in enumerate(pack) if formid is not None))
+                            for i, pack in Route.veldtpacks.items())
+    Route.lowerbounds = remaining_cost_bounds(Route.script)
+
+
+def guaranteed_battles(steps, threatrate):
+    """
+    A battle is certain once threat >> 8 is above any rng value ie: threat >= 0x10000, and threat only ever starts a
+    zone at 0 or more, so every run of 0x10000 / threatrate steps holds at least one battle.
+    :param steps: the steps taken
+    :param threatrate: the threat added on each step
+    :return: the fewest battles possible in steps steps
+    """
+    if threatrate <= 0:
+        return 0
+    return steps // -(-0x10000 // threatrate)
+
+
+def remaining_cost_bounds(script):
+    """
+    Works out a lower bound on the cost still to be paid from each position of the script to its end, so that
+    Route.heuristic never overestimates and encounter_search expands routes which are further along the script first
+    when nothing cheaper is waiting.
+
+    Each instruction contributes what every route has to pay for it: STEP_VALUE for each of a travel instruction's
+    steps plus its guaranteed battles at the cheapest formation of the zone, and the cheapest formation of a random
+    encounter. Forced encounters, extra steps, resets and penalties only ever add cost so they are left out.
+    That only holds while no formation can cost less than 0. A weight which makes any formation cost negative ( ie:
+    wt 0 -1 ) means more battles can lower the cost, so positions up to the last such weighted instruction get no
+    bound at all which is the plain cost ordering used before.
+    :param script: Route.script
+    :return: list of len(script) + 1 lower bounds indexed by scriptptr
+    """
+    veldt_formations = [formid for pack in Route.veldtpacks.values() for formid in pack if formid is not None]
+    lowest = {}
+    weight = 1.0 # the weight a new Route starts with
+    costs = []
+    for instr in script:
+        if instr.weight:
+            weight = instr.weightval
+        if weight not in lowest:
+            # also builds the cost tables the search will use for this weight
+            lowest[weight] = min(min(cost_table(weight)), min(cost_table(weight, avoidgau=True)))
+        table = cost_table(weight)
+        cost = None
+        if instr.travel and instr.veldt:
+            cost = instr.steps * STEP_VALUE
+            # the veldt's threat rate is forced
+            battles = guaranteed_battles(instr.steps, instr.threatrate)
+            if battles:
+                veldt_table = cost_table(weight, avoidgau=instr.avoidgau)
+                cost += battles * min(veldt_table[formid] for formid in veldt_formations)
+        elif instr.travel:
+            cost = instr.steps * STEP_VALUE
+            # an overworld zone can keep the threat rate of an earlier zone so only forced or dungeon rates are known
+            if instr.force_threat or not instr.fset.overworld:
+                battles = guaranteed_battles(instr.steps, instr.threatrate)
+                if battles:
+                    cost += battles * min(table[f.formid] for f in instr.fset.formations)
+        elif instr.random:
+            cost = min(table[f.formid] for f in instr.fset.formations)
+        costs.append((cost or 0, lowest[weight] < 0))
+
+    bounds = [0] * (len(script) + 1)
+    for i in range(len(script) - 1, -1, -1):
+        cost, negative = costs[i]
+        if negative:
+            break
+        bounds[i] = bounds[i + 1] + cost
+    return bounds
+
+
+def read_rom_data(filename):
+    """
+    Reads the monsters, formations, formation sets and rng string from the rom and the lete river tables.
+    :param filename: the rom file
+    :return: dict of everything load_rom_data needs, the contents of a snapshot
+    """
+    method_logger = context_logger("read_rom_data")
+    rom = Rom(filename)
+    monsters = monsters_from_table()
+    for m in monsters:
+        m.read_stats(rom)
+    method_logger.log("Loaded %s monsters from table", len(monsters))
+    formations = formations_from_rom(rom)
+    method_logger.log("Loaded: %s formations from rom", len(formations))
+    fsets = fsets_from_rom(rom)
+    method_logger.log("Loaded: %s formation sets from rom", len(fsets))
+    riversequence, leterng, returnerrng = load_tables()
+    return {"monsterdict": dict(monsterdict), "formations": formations, "fsets": fsets, "rng": get_rng_string(rom),
+            "riversequence": riversequence, "leterng": leterng, "returnerrng": returnerrng}
+
+
+def load_rom_data(filename, routefile):
+    """
+    Loads the monsters, formations, formation sets and rng string from the rom and the route script, setting up
+    fsetdict and the Route class attributes which the search relies on. The rom data comes from a snapshot when the
+    rom and tables have not changed since it was saved, see snapshot.py.
+    :param filename: the rom file
+    :param routefile: the route file ie: route.txt
+    :return: the rng string
+    """
+    method_logger = context_logger("load_rom_data")
+    key, data = load_snapshot(filename)
+    if data is None:
+        data = read_rom_data(filename)
+        save_snapshot(key, data)
+    else:
+        method_logger.log("Loaded rom data from snapshot")
+        monsterdict.clear()
+        monsterdict.update(data["monsterdict"])
+        index_formations(data["formations"])
+    formations = data["formations"]
+    fsets = data["fsets"]
+    for fset in fsets:
+        fsetdict[fset.setid] = fset
+    rng = data["rng"]
+    Route.steprng = StepRNG(rng)
+    Route.battlerng = BattleRNG(rng)
+    Route.river = LeteRiver(data["riversequence"], data["leterng"], data["returnerrng"], Route.battlerng, fsetdict)
+    if ALLOW_DEBUG_LOGGING:
+        method_logger.log("Loaded: rng string of length %s. %s" % (len(rng), str(rng)))
+    format_script(fsets, formations, routefile)
+    return rng
+
+
+worker_files = None
+
+
+def init_worker(filename, routefile):
+    """
+    ProcessPoolExecutor initializer which loads the rom data once per worker process. Workers which were forked from a
+    process that already loaded the same files reuse it.
+    """
+    global worker_files
+    if worker_files != (filename, routefile):
+        load_rom_data(filename, routefile)
+        worker_files = (filename, routefile)
+
+
+def search_shard(routes, number, anynode, maxsize):
+    """
+    Runs encounter_search for a subset of the initial routes inside a worker process.
+    :return: the solutions found or an empty list if there are none for these routes
+    """
+    try:
+        return encounter_search(routes, number=number, anynode=anynode, maxsize=maxsize)
+    except NoSolutionsError:
+        return []
+
+
+def parallel_search(routes, workers, filename, routefile, number=1, anynode=True, maxsize=25000, report=None):
+    """
+    Searches each initial route ( one per seed and threat ) on its own in a pool of worker processes and merges the
+    solutions the way encounter_search accepts them: cheapest first, at most 2 per seed unless anynode.
+    Each shard is pruned against maxsize on its own so results can differ from a single shared search.
+    :param routes: the initial routes
+    :param workers: the number of worker processes
+    :param filename: the rom file, loaded once by each worker
+    :param routefile: the route file, loaded once by each worker
+    :param report: a report.Report which the merged solutions are written to instead of being returned
+    :return: the merged solutions, empty if they were written to report
+    """
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(filename, routefile)) as executor:
+        shards = [[r] for r in routes]
+        # a seed contributes at most 2 solutions unless anynode so a shard can stop once it has them
+        shard_number = number if anynode else min(number, 2)
+        results = executor.map(search_shard, shards, repeat(shard_number), repeat(anynode), repeat(maxsize))
+        candidates = [s for result in results for s in result]
+
+    # sorted is stable so equal costs stay in seed order
+    candidates = sorted(candidates, key=lambda s: s.heuristic)
+    solutions = []
+    for node in candidates:
+        if len(solutions) >= number:
+            break
+        if anynode or len([s for s in solutions if s.initialseed == node.initialseed]) < 2:
+            solutions.append(node)
+    if not solutions:
+        raise NoSolutionsError("No valid solutions found.")
+    print("%s SOLUTIONS FROM %s SHARDS" % (len(solutions), len(shards)))
+    if report is not None:
+        for solution in solutions:
+            report.write(solution)
+        return []
+    return solutions
+
+
+def pop_option(args, name, default=None):
+    """
+    Removes a "--name value" option from the command line arguments so the positional arguments keep their indexes
+    :param args: list of command line arguments, modified in place
+    :param name: the option ie: --workers
+    :param default: returned when the option is not present
+    :return: the option's value
+    """
+    if name not in args:
+        return default
+    index = args.index(name)
+    value = args[index + 1]
+    del args[index:index + 2]
+    return value
+
+
+def initial_routes(rng, seeds, threats=(0,)):
+    """
+    :param rng: the rng string returned by load_rom_data
+    :param seeds: the initial seeds to search
+    :param threats: the initial threat of the routes
+    :return: ( routes, expanded ) one Route per threat and seed, walked through the start of the script together when
+             lockstep is available, and the number of expansions encounter_search would have made to get them there
+    """
+    routes = [Route(seed, rng, t) for t in threats for seed in seeds]
+    if lockstep is not None:
+        return lockstep.advance(routes, STEP_VALUE)
+    return routes, 0
 
 
 if __name__ == "__main__":
     date = datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
-    method_logger = MethodContextLogger("__main__")
+    method_logger = context_logger("__main__")
     method_logger.log("STARTING MAIN!")
-    filename = argv[1]
-    routefile = argv[2]
-    if len(argv) >= 4:
-        outfile = argv[3]
+    args = list(argv)
+    workers = int(pop_option(args, "--workers", 1))
+    jsonfile = pop_option(args, "--jsonl")
+    statsfile = pop_option(args, "--stats")
+    statsinterval = float(pop_option(args, "--stats-interval", 60))
+    profiledir = pop_option(args, "--profile")
+    profilemode = pop_option(args, "--profile-mode", "cprofile")
+    profiletop = int(pop_option(args, "--profile-top", 30))
+    checkpointfile = pop_option(args, "--checkpoint")
+    checkpointinterval = float(pop_option(args, "--checkpoint-interval", 300))
+    resume = "--resume" in args
+    if resume:
+        args.remove("--resume")
+        if checkpointfile is None:
+            raise SystemExit("--resume needs the --checkpoint file to resume from")
+    if workers > 1:
+        for option, value in (("--stats", statsfile), ("--checkpoint", checkpointfile)):
+            if value is not None:
+                raise SystemExit("%s can not be used with --workers" % option)
+    filename = args[1]
+    routefile = args[2]
+    if len(args) >= 4:
+        outfile = args[3]
     else:
         outfile = "report.txt"
-    if len(argv) >= 5:
-        seed = int(argv[4])
+    if len(args) >= 5:
+        seed = int(args[4])
     else:
         seed = None
-    if len(argv) >= 6:
-        print("INFO: ALLOW_DEBUG_LOGGING is currently a disabled feature. Argument argv[5] '%s' will be ignored. This is due to the size of resulting debug log files as currently implemented being estimated to exceed 10 GB." % argv[5])
+    if len(args) >= 6:
+        print("INFO: ALLOW_DEBUG_LOGGING is currently a disabled feature. Argument argv[5] '%s' will be ignored. This is due to the size of resulting debug log files as currently implemented being estimated to exceed 10 GB." % args[5])
         # ALLOW_DEBUG_LOGGING = 'true' == (argv[5].lower() if argv[5] else 'false')
         # print("ALLOW_LOGGING = %s" % ALLOW_DEBUG_LOGGING)
         # if not ALLOW_DEBUG_LOGGING:
         #     print("Did you mean to provide a falsey argument '%s' for ALLOW_DEBUG_LOGGING? It is false by default..." % argv[5])
         # else:
         #     print("WARNING: Setting ALLOW_DEBUG_LOGGING to true will make I estimate a 10-20 GB size log file at ./logs/main.log. If you need to kill the program just type ctrl + c in a bash window or whatever steps kill a program on your device ie: task manager/command prompt if needed.")
-    if len(argv) >= 7:
+    if len(args) >= 7:
         print("INFO: ALLOW_QUEUE_LOGGING is currently a disabled feature. Argument argv[6] '%s' will be ignored. This is due to the size of resulting debug log files as currently implemented being estimated to exceed 10 GB." %
-              argv[6])
+              args[6])
         # ALLOW_QUEUE_LOGGING = 'true' == (argv[5].lower() if argv[6] else 'false')
         # print("ALLOW_QUEUE_LOGGING = %s" % ALLOW_QUEUE_LOGGING)
         # if not ALLOW_QUEUE_LOGGING:
@@ -1445,35 +2022,46 @@ if __name__ == "__main__":
         #     print("Setting ALLOW_QUEUE_LOGGING to true without ALLOW_DEBUG_LOGGING being true is noop")
         # else:
         #     print("WARNING: Setting ALLOW_DEBUG_LOGGING and ALLOW_QUEUE_LOGGING to true will make multi-GB log file at ./logs/main.log. If you need to kill the program just type ctrl + c in a bash window or whatever steps kill a program on your device ie: task manager/command prompt if needed.")
-    monsters = monsters_from_table()
-    for m in monsters:
-        m.read_stats(filename)
-    method_logger.log("Loaded %s monsters from table" % len(monsters))
-    formations = formations_from_rom(filename)
-    method_logger.log("Loaded: %s formations from rom" % len(formations))
-    fsets = fsets_from_rom(filename, formations)
-    method_logger.log("Loaded: %s formation sets from rom" % len(fsets))
-    for fset in fsets:
-        fsetdict[fset.setid] = fset
-    rng = get_rng_string(filename)
-    method_logger.log("Loaded: rng string of length %s. %s" % (len(rng), str(rng)))
+    profiler = None if profiledir is None else Profiler(profiledir, profilemode, profiletop)
+    with profile_phase(profiler, "load"):
+        rng = load_rom_data(filename, routefile)
+        # worker processes forked from here already have the rom data
+        worker_files = (filename, routefile)
     threats = [0, 0x540, 0x1080, 0x2160, 0x5555]
     #threats = [0x5555]
     #threats = [0xC0 * i for i in range(80, 160)]
     threats = [0]
-    if seed is None:
-        #routes = [Route(seed, rng, t) for t in threats for seed in [96]]
-        routes = [Route(seed, rng, t) for t in threats for seed in range(0x100)]
-        #routes = [Route(seed, rng, t) for t in threats for seed in [108, 142, 143, 171, 198, 199, 201, 202, 232, 238, 239]]
-        #routes = [Route(seed, rng, t) for t in threats for seed in [108, 143, 171, 198, 199, 201, 202, 232, 238, 239]]
-        #routes = [Route(seed, rng, t) for t in threats for seed in [238]]
-        #routes = [Route(seed, rng, t) for t in threats for seed in [244]]
-        #routes = [Route(seed, rng, t) for t in threats for seed in [0xb9, 0xb8, 0xf4]]
-    else:
-        routes = [Route(seed, rng, t) for t in threats]
-    format_script(fsets, formations, routefile)
-    maxsize = 10000
-    solutions = encounter_search(routes, number=20, anynode=False, maxsize=maxsize)
+    with profile_phase(profiler, "search"):
+        if seed is None:
+            #routes = [Route(seed, rng, t) for t in threats for seed in [96]]
+            routes, expanded = initial_routes(rng, range(0x100), threats)
+            #routes = [Route(seed, rng, t) for t in threats for seed in [108, 142, 143, 171, 198, 199, 201, 202, 232, 238, 239]]
+            #routes = [Route(seed, rng, t) for t in threats for seed in [108, 143, 171, 198, 199, 201, 202, 232, 238, 239]]
+            #routes = [Route(seed, rng, t) for t in threats for seed in [238]]
+            #routes = [Route(seed, rng, t) for t in threats for seed in [244]]
+            #routes = [Route(seed, rng, t) for t in threats for seed in [0xb9, 0xb8, 0xf4]]
+        else:
+            routes, expanded = initial_routes(rng, [seed], threats)
+        maxsize = 10000
+        report = Report(outfile, jsonfile, Route.formations)
+        if workers > 1:
+            parallel_search(routes, workers, filename, routefile, number=20, anynode=False, maxsize=maxsize,
+                            report=report)
+        else:
+            stats = None if statsfile is None else SearchStats(statsfile, statsinterval)
+            checkpoint = None
+            resumed = None
+            if checkpointfile is not None:
+                # a checkpoint is only resumed by the same search of the same rom and route file
+                key = (file_hash(filename), file_hash(routefile), seed, threats, maxsize)
+                checkpoint = Checkpoint(checkpointfile, key, checkpointinterval)
+                if resume and path.exists(checkpointfile):
+                    resumed = checkpoint.load(Route, rng)
+                    report.resume(resumed["report"])
+                elif resume:
+                    print("No checkpoint %s, starting from the beginning" % checkpointfile)
+            encounter_search(routes, number=20, anynode=False, maxsize=maxsize, report=report, stats=stats,
+                             checkpoint=checkpoint, resume=resumed, expanded=expanded)
     '''
     import pdb; pdb.set_trace()
     print(len(solutions))
@@ -1498,13 +2086,7 @@ if __name__ == "__main__":
     solutions = encounter_search(routes, number=20, anynode=False, maxsize=maxsize)
     '''
 
-    f = open(outfile, "w+")
-    for solution in solutions:
-        f.write("INITIAL SEED: %s\n" % solution.initialseed)
-        f.write(solution.travelog + "\n")
-        f.write(str(solution) + "\n\n")
-        f.write("-" * 60 + "\n")
-    f.close()
+    report.close()
     method_logger.log("Completed program")
 
 # interesting... because of the way FF6's RNG works, it's possible to "eat" an encounter by taking extra steps in a low-rate zone, shifting the RNG pointer past a dangerous value
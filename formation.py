@@ -1,5 +1,6 @@
-from utils import read_multi
+from struct import Struct
 from monster import monsterdict, monsters_from_table
+from rom import Rom
 from sys import argv
 import logging
 
@@ -11,6 +12,9 @@ if escape is possible, if pincer and back attack are possible, etc...
 
 Each FormationSet object contains collections of formations, formationIds, and a best_formation based on cost calculation.
 
+Formation costs only depend on the formation, the route's weight, smokebombs and avoidgau so cost_table computes the
+cost of every formation once for each combination used and the search looks costs up by formation id.
+
 Some good information on formations is available on this page https://gamefaqs.gamespot.com/snes/554041-final-fantasy-iii/faqs/71889
 in the appendices.
 """
@@ -32,6 +36,35 @@ for line in open("tables/customcosts.txt"):
     cost = int(cost)
     customcosts[formid] = cost
 
+formationdict = {}
+"""formation id -> Formation"""
+enemy_formations = {}
+"""enemy id ( monster.monsterdict key ) -> sorted list of the ids of the formations it appears in"""
+cost_tables = {}
+
+FORMATION = Struct("<15B")
+"""mould, enemies present, 6 enemy ids, 6 enemy positions and bosses"""
+FORMATION_AUX = Struct("<4B")
+"""misc1, misc2, eventscript and misc3"""
+FSET4 = Struct("<4H")
+FSET2 = Struct("<2H")
+
+
+def cost_table(weight=1.0, smokebombs=False, avoidgau=False):
+    """
+    :param weight: the route weight, see Formation.cost
+    :param smokebombs: see Formation.cost
+    :param avoidgau: see Formation.cost
+    :return: list of Formation.cost for every formation indexed by formation id, built the first time a combination
+             is asked for
+    """
+    key = (weight, smokebombs, avoidgau)
+    table = cost_tables.get(key)
+    if table is None:
+        table = [formationdict[formid].cost(weight, smokebombs, avoidgau) for formid in range(len(formationdict))]
+        cost_tables[key] = table
+    return table
+
 
 class Formation():
     def __init__(self, formid):
@@ -41,8 +74,15 @@ class Formation():
         # this logic appears to be based just on how the data is stored in the rom
         self.pointer = 0xf6200 + (formid*15)
         self.auxpointer = 0xf5900 + (formid*4)
+        # the report text for this formation ie: "Guard x2 (3)", computed once the enemies are known
+        self.label = None
 
     def __repr__(self):
+        if self.label is None:
+            self.label = self.make_label()
+        return self.label
+
+    def make_label(self):
         counter = {}
         for e in self.present_enemies:
             #name = "%s %s %s" % (e.name, e.stats['level'], e.id)
@@ -58,21 +98,23 @@ class Formation():
         return "%s (%x)" % (s, self.formid)
         #return "%s (%x) %s" % (s, self.formid, bool(self.pincer_prohibited))
 
-    def read_data(self, filename):
-        f = open(filename, 'r+b')
-        f.seek(self.pointer)
-        self.mouldbyte = ord(f.read(1))
-        self.enemies_present = ord(f.read(1))
-        self.enemy_ids = list(f.read(6))
-        self.enemy_pos = list(f.read(6))
-        self.bosses = ord(f.read(1))
-
-        f.seek(self.auxpointer)
-        self.misc1 = ord(f.read(1))
-        self.misc2 = ord(f.read(1))
-        self.eventscript = ord(f.read(1))
-        self.misc3 = ord(f.read(1))
-        f.close()
+    def read_data(self, rom, record=None, aux=None):
+        """
+        :param rom: a rom.Rom
+        :param record: the values of this formation's FORMATION record when they were already decoded
+        :param aux: the values of this formation's FORMATION_AUX record when they were already decoded
+        :return: None
+        """
+        if record is None:
+            record = rom.unpack(FORMATION, self.pointer)
+        if aux is None:
+            aux = rom.unpack(FORMATION_AUX, self.auxpointer)
+        self.mouldbyte = record[0]
+        self.enemies_present = record[1]
+        self.enemy_ids = list(record[2:8])
+        self.enemy_pos = list(record[8:14])
+        self.bosses = record[14]
+        self.misc1, self.misc2, self.eventscript, self.misc3 = aux
 
     @property
     def mould(self):
@@ -114,6 +156,11 @@ class Formation():
                 continue
             e.add_mould(self.mould)
         self.num_enemies = len(self.present_enemies)
+        self.label = self.make_label()
+        # these only depend on the enemies so they are worked out once rather than for every battle
+        self.inescapable = any([e.inescapable for e in self.present_enemies])
+        self.escape_difficult = any([e.escape_difficult for e in self.present_enemies])
+        self.xp = sum(e.stats['xp'] for e in self.present_enemies)
 
     def set_big_enemy_ids(self, eids):
         self.bosses = 0
@@ -125,17 +172,11 @@ class Formation():
                 self.bosses |= (1 << n)
             self.enemy_ids.append(eid & 0xFF)
 
-    def read_mould(self, filename):
+    def read_mould(self, rom):
         mouldspecsptrs = 0x2D01A
-        f = open(filename, 'r+b')
-        pointer = mouldspecsptrs + (2*self.mould)
-        f.seek(pointer)
-        pointer = read_multi(f, length=2) | 0x20000
+        pointer = rom.word(mouldspecsptrs + (2*self.mould)) | 0x20000
         for i in range(6):
-            f.seek(pointer + (i*4))
-            a, b = tuple(f.read(2))
-            width = ord(f.read(1))
-            height = ord(f.read(1))
+            a, b, width, height = rom.bytes(pointer + (i*4), 4)
             enemy = self.enemies[i]
             if enemy:
                 enemy.update_size(width, height)
@@ -152,14 +193,6 @@ class Formation():
     def front_prohibited(self):
         return self.misc1 & 0x10
 
-    @property
-    def inescapable(self):
-        return any([e.inescapable for e in self.present_enemies])
-
-    @property
-    def escape_difficult(self):
-        return any([e.escape_difficult for e in self.present_enemies])
-
     def cost(self, weight=1.0, smokebombs=False, avoidgau=False):
         smokebombs = smokebombs and not self.inescapable
         if self.formid in customcosts:
@@ -194,12 +227,6 @@ class Formation():
 
         return cost
 
-    @property
-    def xp(self):
-        xp = sum(e.stats['xp'] for e in self.present_enemies)
-        #print(self, xp)
-        return xp
-
 
 class FormationSet():
     def __init__(self, setid):
@@ -232,69 +259,92 @@ class FormationSet():
                 s += "%s, " % str(f)
         return s.strip()
 
-    def read_data(self, filename):
-        f = open(filename, 'r+b')
-        f.seek(self.pointer)
-        self.formids = []
+    def read_data(self, rom):
         if self.setid <= 0xFF:
-            num_encounters = 4
+            layout = FSET4
         else:
-            num_encounters = 2
-        for i in range(num_encounters):
-            self.formids.append(read_multi(f, length=2))
-        f.close()
+            layout = FSET2
+        self.formids = list(rom.unpack(layout, self.pointer))
 
-    def set_formations(self, formations):
+    def set_formations(self):
+        """
+        Looks up the formations for formids in formationdict, formations_from_rom must have been called first
+        :return: None
+        """
         self.formations = []
         for i in self.formids:
             if i & 0x8000:
                 i &= 0x7FFF
                 self.floatingcontinent = True
-            f = [j for j in formations if j.formid == i]
-            f = f[0]
-            self.formations.append(f)
-        self.best_formation = min(self.formations, key=lambda f: f.cost())
+            self.formations.append(formationdict[i])
+        costs = cost_table()
+        self.best_formation = min(self.formations, key=lambda f: costs[f.formid])
 
     def rank(self):
         return sum(f.rank() for f in self.formations) / 4.0
 
 
-def formations_from_rom(filename):
+def formations_from_rom(rom):
     """
     Copied from https://gamefaqs.gamespot.com/snes/554041-final-fantasy-iii/faqs/71889?page=0#Monster%20Mould
     There are 575 different monster formations in the game's memory, but some of them are duplicates, used for cutscenes, or are dummied.
     Even ignoring bosses that still leaves over 400 formations that can actually be encountered in game.
-    :param filename:
+    :param rom: a rom.Rom
     :return:
     """
     formations = [Formation(i) for i in range(576)]
-    for f in formations:
-        f.read_data(filename)
+    # both tables are contiguous so every record is decoded in one pass
+    records = rom.unpack_table(FORMATION, formations[0].pointer, len(formations))
+    auxes = rom.unpack_table(FORMATION_AUX, formations[0].auxpointer, len(formations))
+    for f, record, aux in zip(formations, records, auxes):
+        f.read_data(rom, record, aux)
         f.lookup_enemies()
         #print(f)
+    index_formations(formations)
     return formations
 
 
-def fsets_from_rom(filename, formations):
+def index_formations(formations):
+    """
+    Fills formationdict and enemy_formations from formations and drops any cost tables of previous formations
+    :param formations: every Formation, ordered by formid
+    :return: None
+    """
+    formationdict.clear()
+    enemy_formations.clear()
+    cost_tables.clear()
+    for f in formations:
+        formationdict[f.formid] = f
+        for eid in f.present_enemy_ids:
+            formids = enemy_formations.setdefault(eid, [])
+            if not formids or formids[-1] != f.formid:
+                formids.append(f.formid)
+
+
+def fsets_from_rom(rom):
+    """
+    :param rom: a rom.Rom
+    :return: list of every FormationSet, formations_from_rom must have been called first
+    """
     fsets = []
     for i in range(0x200):
         f = FormationSet(i)
-        f.read_data(filename)
-        f.set_formations(formations)
+        f.read_data(rom)
+        f.set_formations()
         fsets.append(f)
 
     return fsets
 
 
 if __name__ == "__main__":
-    filename = argv[1]
+    rom = Rom(argv[1])
     monsters = monsters_from_table()
     for m in monsters:
-        m.read_stats(filename)
-    formations = formations_from_rom(filename)
+        m.read_stats(rom)
+    formations = formations_from_rom(rom)
     for f in formations:
         print(f, f.mould)
-    fsets = fsets_from_rom(filename, formations)
+    fsets = fsets_from_rom(rom)
     for fset in fsets:
         print(fset)
         print()
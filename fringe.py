@@ -0,0 +1,206 @@
+from bisect import bisect_left
+from heapq import heapify, heappush, heappop
+
+"""
+The search fringe used by encrouter.encounter_search.
+
+Entries are ( priority, order, route ) tuples where priority is route.heuristic computed once when the route is pushed
+and order is a counter which only ever increases. Two routes with the same priority are popped in the order they were
+pushed, so the heap never has to compare Route objects and the search is deterministic.
+
+Besides the heap of every route, the fringe keeps a heap of the routes of each initial seed and counts its routes per
+( initialseed, scriptptr ) bucket. The pruning pass of encounter_search only ever drops routes of a seed which has 3 or
+more routes, 2 of them behind the progress mark, so it finds those seeds from the counts and only sorts and filters
+their heaps. Dropped routes are left in the main heap and skipped when they reach its top, and the heap is rebuilt
+without them once they are half of it.
+"""
+
+
+class Fringe:
+    """
+    A single threaded min-heap of routes ordered by heuristic then insertion order.
+    """
+
+    def __init__(self):
+        self.queue = []
+        self.order = 0
+        self.seeds = {} # initialseed -> heap of its entries
+        self.removed = set([]) # order of the entries dropped from seeds which are still in queue
+        self.ranked = None # sorted ( priority, order ) of every entry for rank, None until rank needs it
+        self.buckets = {}
+
+    def push(self, route, priority=None):
+        """
+        :param route: the Route to add
+        :param priority: the priority to use, defaults to route.heuristic
+        :return: None
+        """
+        if priority is None:
+            priority = route.heuristic
+        entry = (priority, self.order, route)
+        heappush(self.queue, entry)
+        self.ranked = None
+        seed = self.seeds.get(route.initialseed)
+        if seed is None:
+            self.seeds[route.initialseed] = [entry]
+        else:
+            heappush(seed, entry)
+        self.order += 1
+        self.count(route, 1)
+
+    def count(self, route, change):
+        bucket = (route.initialseed, route.scriptptr)
+        size = self.buckets.get(bucket, 0) + change
+        if size:
+            self.buckets[bucket] = size
+        else:
+            del self.buckets[bucket]
+
+    def discard_removed(self):
+        """
+        Pops dropped entries off the top of the main heap
+        """
+        while self.removed and self.queue[0][1] in self.removed:
+            self.removed.discard(heappop(self.queue)[1])
+
+    def pop(self):
+        """
+        :return: ( priority, route ) with the lowest priority, raises IndexError if the fringe is empty
+        """
+        self.discard_removed()
+        priority, order, route = heappop(self.queue)
+        self.ranked = None
+        # the cheapest route of all is also the cheapest of its seed
+        seed = self.seeds[route.initialseed]
+        heappop(seed)
+        if not seed:
+            del self.seeds[route.initialseed]
+        self.count(route, -1)
+        return priority, route
+
+    def peek(self):
+        """
+        :return: ( priority, route ) which pop would return without removing it, raises IndexError if empty
+        """
+        self.discard_removed()
+        priority, order, route = self.queue[0]
+        return priority, route
+
+    def pop_many(self, count=None):
+        """
+        :param count: the maximum number of routes to pop, None to empty the fringe
+        :return: list of ( priority, route ) in the order pop would have returned them
+        """
+        popped = []
+        while len(self) and (count is None or len(popped) < count):
+            popped.append(self.pop())
+        return popped
+
+    def entries(self):
+        """
+        :return: list of the ( priority, order, route ) entries in the fringe, in no particular order
+        """
+        if not self.removed:
+            return list(self.queue)
+        return [entry for entry in self.queue if entry[1] not in self.removed]
+
+    def drain(self):
+        """
+        Empties the fringe
+        :return: list of ( priority, order, route ) entries sorted in the order pop would have returned them
+        """
+        entries = sorted(self.entries())
+        self.queue = []
+        self.seeds = {}
+        self.removed = set([])
+        self.ranked = None
+        self.buckets = {}
+        return entries
+
+    def restore(self, entries):
+        """
+        Refills an empty fringe with entries returned by drain or entries. The entries keep their original insertion
+        order.
+        :param entries: a list of ( priority, order, route ) entries
+        :return: None
+        """
+        self.queue = list(entries)
+        heapify(self.queue)
+        self.ranked = None
+        for entry in self.queue:
+            self.seeds.setdefault(entry[2].initialseed, []).append(entry)
+            self.count(entry[2], 1)
+        for seed in self.seeds.values():
+            heapify(seed)
+
+    def prunable_seeds(self, scriptptr):
+        """
+        encounter_search's pruning pass only drops a route before scriptptr once an earlier route of its seed was seen
+        and another one before scriptptr was let through by the toggler, so it can only drop anything for a seed with
+        at least 3 routes, 2 of them before scriptptr
+        :param scriptptr: the progress mark of the pass
+        :return: sorted list of the initial seeds the pass may drop routes of
+        """
+        totals = {}
+        below = {}
+        for (initialseed, ptr), size in self.buckets.items():
+            totals[initialseed] = totals.get(initialseed, 0) + size
+            if ptr < scriptptr:
+                below[initialseed] = below.get(initialseed, 0) + size
+        return sorted(initialseed for initialseed, size in below.items() if size >= 2 and totals[initialseed] >= 3)
+
+    def seed_entries(self, initialseed):
+        """
+        :param initialseed: an initial seed with routes in the fringe
+        :return: list of the seed's ( priority, order, route ) entries sorted in the order pop would return them
+        """
+        return sorted(self.seeds[initialseed])
+
+    def rank(self, entry):
+        """
+        :param entry: a ( priority, order, route ) entry in the fringe
+        :return: the number of entries pop would return before it
+        """
+        # sorted once and reused until the fringe changes, a pruning pass asks for many ranks without changing it
+        if self.ranked is None:
+            self.ranked = sorted(entry[:2] for entry in self.entries())
+        return bisect_left(self.ranked, entry[:2])
+
+    def remove(self, entries):
+        """
+        Drops entries from the fringe
+        :param entries: list of ( priority, order, route ) entries in the fringe
+        :return: None
+        """
+        dropped = {}
+        self.ranked = None
+        for entry in entries:
+            dropped.setdefault(entry[2].initialseed, set([])).add(entry[1])
+            self.removed.add(entry[1])
+            self.count(entry[2], -1)
+        for initialseed, orders in dropped.items():
+            seed = [entry for entry in self.seeds[initialseed] if entry[1] not in orders]
+            if seed:
+                heapify(seed)
+                self.seeds[initialseed] = seed
+            else:
+                del self.seeds[initialseed]
+        if len(self.removed) * 2 > len(self.queue):
+            self.queue = self.entries()
+            heapify(self.queue)
+            self.removed = set([])
+
+    def lowest_scriptptr(self):
+        """
+        :return: the lowest scriptptr of any route in the fringe, None if the fringe is empty
+        """
+        return min((ptr for initialseed, ptr in self.buckets), default=None)
+
+    def routes(self):
+        """
+        :return: the routes in the fringe in heap order ( not sorted )
+        """
+        return [entry[2] for entry in self.entries()]
+
+    def __len__(self):
+        return len(self.queue) - len(self.removed)
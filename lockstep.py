@@ -0,0 +1,344 @@
+from heapq import heapify, heappush, heappop
+import numpy
+from formation import cost_table
+from travelog import LOG_DEBUG, LOG_ZONE, LOG_ENCOUNTER, LOG_RANDOM, LOG_EVENT
+
+"""
+Advances a batch of routes which are all at the same script position in lockstep using numpy arrays.
+
+When every seed is searched, __main__ starts 256 routes which walk the exact same script. Until the first instruction
+where Route.expand can produce anything other than the route itself ( forced encounters, extra steps, menu resets,
+lete, reset, veldt and force instructions ) every route simply executes the instructions one after the other, so those
+instructions are run here for all of the routes at once and individual Route objects are only updated at the point
+where the search has to branch.
+
+The search would not have walked every route to that point before branching though: it expands the cheapest route
+first, so some routes are still behind when the first one branches, and routes with the same priority are expanded in
+the order they were queued. replay works out from the costs along the way where the search would have left each route
+and in which order it would have queued them, and the routes are handed back there, so the search expands exactly the
+same routes in the same order with or without lockstep.
+
+numpy is optional. encrouter only uses this module when numpy can be imported.
+"""
+
+NO_THREATRATE = -1
+
+
+def branches_at(script, scriptptr):
+    """
+    :param script: Route.script
+    :param scriptptr: a position in the script
+    :return: True if Route.expand may create children other than the route itself at scriptptr
+    """
+    instr = script[scriptptr]
+    previous = script[scriptptr - 1] if scriptptr > 0 else None
+    if previous is None and instr.travel:
+        return True
+    if previous is not None and previous.travel and previous.steps >= 2:
+        return True
+    if instr.restriction and instr.rtype != "xp":
+        return True
+    return instr.lete or instr.reset or instr.force or instr.veldt
+
+
+class Lockstep:
+    """
+    The state of a batch of routes as arrays, one row per route. Travel log events and seen formations are kept per
+    row in python lists since only the rows which fight need them.
+    """
+
+    def __init__(self, routes, step_value):
+        """
+        :param routes: Route objects which all share the same scriptptr, weight, rng and smokebombs
+        :param step_value: the cost of a single step, encrouter.STEP_VALUE
+        """
+        self.routes = routes
+        self.route_class = type(routes[0])
+        self.step_value = step_value
+        self.scriptptr = routes[0].scriptptr
+        self.weight = routes[0].weight
+        self.smokebombs = routes[0].smokebombs
+        self.rng = numpy.array(routes[0].rng, dtype=numpy.int64)
+        battlerng = self.route_class.battlerng
+        self.slots4 = numpy.frombuffer(battlerng.slots4, dtype=numpy.uint8).astype(numpy.int64)
+        self.slots2 = numpy.frombuffer(battlerng.slots2, dtype=numpy.uint8).astype(numpy.int64)
+
+        def column(attribute, dtype=numpy.int64):
+            return numpy.array([getattr(r, attribute) for r in routes], dtype=dtype)
+
+        self.stepseed = column("stepseed")
+        self.stepcounter = column("stepcounter")
+        self.battleseed = column("battleseed")
+        self.battlecounter = column("battlecounter")
+        self.threat = column("threat")
+        self.cost = column("cost", numpy.float64)
+        # Route.cost starts out as the int 0 and stays an int until a float is added to it, which shows in the report
+        self.int_cost = numpy.array([isinstance(r.cost, int) for r in routes], dtype=bool)
+        self.xp = column("xp")
+        self.num_encounters = column("num_encounters")
+        self.boundary_flag = column("boundary_flag", bool)
+        self.overworld_threatrate = numpy.array(
+            [NO_THREATRATE if r.overworld_threatrate is None else r.overworld_threatrate for r in routes],
+            dtype=numpy.int64)
+        self.alive = numpy.ones(len(routes), dtype=bool)
+        self.events = [[] for _ in routes]
+        self.seen = [0 for _ in routes] # Route.seen_formations bitmask of the formations seen by each row
+
+    @classmethod
+    def supported(cls, routes):
+        if len(routes) < 2:
+            return False
+        first = routes[0]
+        return all(r.scriptptr == first.scriptptr and r.weight == first.weight and r.rng == first.rng and
+                   r.smokebombs == first.smokebombs for r in routes)
+
+    def scalar_cost(self, row):
+        if self.int_cost[row]:
+            return int(self.cost[row])
+        return float(self.cost[row])
+
+    def add_cost(self, rows, values, int_values):
+        """
+        Adds a cost to the given rows, values is a scalar or an array aligned with rows.
+        """
+        self.cost[rows] += values
+        if not int_values:
+            self.int_cost[rows] = False
+
+    def log_debug(self):
+        rows = numpy.flatnonzero(self.alive)
+        state = zip(rows.tolist(), self.stepseed[rows].tolist(), self.stepcounter[rows].tolist(),
+                    self.battleseed[rows].tolist(), self.battlecounter[rows].tolist(), self.threat[rows].tolist())
+        for row, stepseed, stepcounter, battleseed, battlecounter, threat in state:
+            self.events[row].append((LOG_DEBUG, stepseed, stepcounter, battleseed, battlecounter, threat,
+                                     self.scalar_cost(row)))
+
+    def menu_reset_possible(self, instr):
+        """
+        Mirrors the menu reset check in Route.expand for every row
+        """
+        if not instr.fset.overworld or instr.force_threat:
+            return False
+        threatrate = self.overworld_threatrate[self.alive]
+        return bool(numpy.any((threatrate > 0) & (threatrate > instr.threatrate)))
+
+    def increment_battle(self, rows):
+        counter = self.battlecounter[rows] + 1
+        wrapped = counter > 0xFF
+        self.battlecounter[rows] = counter & 0xFF
+        self.battleseed[rows] = numpy.where(wrapped, self.battleseed[rows] + 0x17, self.battleseed[rows]) & 0xFF
+
+    def predict_formations(self, rows, fset):
+        """
+        Vectorised Route.predict_formation for the given rows
+        :return: the slot of fset.formations picked for each row
+        """
+        self.increment_battle(rows)
+        index = self.battlecounter[rows] << 8 | self.battleseed[rows]
+        slots = self.slots4 if len(fset.formations) == 4 else self.slots2
+        return slots[index]
+
+    def fight(self, rows, fset, kind):
+        """
+        Picks, logs and pays for the formations fought by rows, see Route.predict_formation
+        """
+        slots = self.predict_formations(rows, fset).tolist()
+        costs = cost_table(self.weight, self.smokebombs)
+        for row, slot in zip(rows.tolist(), slots):
+            formation = fset.formations[slot]
+            if formation.formid < 0x200:
+                self.seen[row] |= 1 << formation.formid
+            self.xp[row] += formation.xp
+            cost = costs[formation.formid]
+            self.cost[row] += cost
+            if not isinstance(cost, int):
+                self.int_cost[row] = False
+            self.events[row].append((kind, formation.formid, cost))
+
+    def travel(self, instr, debug=True):
+        """
+        Vectorised Route.predict_encounters for a whole travel instruction
+        """
+        steps = instr.steps
+        self.boundary_flag[:] = False
+        if steps:
+            for row in numpy.flatnonzero(self.alive).tolist():
+                self.events[row].append((LOG_ZONE, steps, instr.fset.setid))
+        taken = numpy.zeros(len(self.routes), dtype=numpy.int64)
+        for remaining in range(steps - 1, -1, -1):
+            # Route.step_threatrate
+            if instr.force_threat:
+                self.overworld_threatrate[:] = instr.threatrate
+                threatrate = self.overworld_threatrate
+            elif instr.fset.overworld:
+                unset = self.overworld_threatrate == NO_THREATRATE
+                self.overworld_threatrate[unset] = instr.threatrate
+                threatrate = self.overworld_threatrate
+            else:
+                self.overworld_threatrate[:] = NO_THREATRATE
+                threatrate = instr.threatrate
+
+            # Route.take_a_step and Route.predict_battle
+            self.cost[self.alive] += self.step_value
+            self.int_cost[self.alive] = False
+            self.threat += threatrate
+            taken += 1
+            counter = self.stepcounter + 1
+            wrapped = counter > 0xFF
+            self.stepcounter = counter & 0xFF
+            self.stepseed = numpy.where(wrapped, self.stepseed + 0x11, self.stepseed) & 0xFF
+            value = (self.rng[self.stepcounter] + self.stepseed) & 0xFF
+            battle = self.alive & (value < (self.threat >> 8))
+            if not battle.any():
+                continue
+
+            rows = numpy.flatnonzero(battle)
+            self.num_encounters[rows] += 1
+            self.fight(rows, instr.fset, LOG_ENCOUNTER)
+            if debug:
+                for row in rows.tolist():
+                    self.events[row].append((LOG_DEBUG, int(self.stepseed[row]), int(self.stepcounter[row]),
+                                             int(self.battleseed[row]), int(self.battlecounter[row]),
+                                             int(self.threat[row]), self.scalar_cost(row)))
+            self.threat[rows] = 0
+            if instr.fset.overworld:
+                self.overworld_threatrate[rows] = instr.threatrate
+
+            # Route.predict_encounters boundary costs
+            if remaining <= 3:
+                self.add_cost(rows, 0.1, False)
+                self.boundary_flag[rows] = True
+            close = rows[taken[rows] <= 4]
+            self.add_cost(close, 0.1, False)
+            taken[rows] = 0
+
+    def execute(self, instr):
+        """
+        Vectorised Route.execute_script for the instructions which never branch
+        """
+        self.log_debug()
+        if instr.restriction:
+            if instr.value is not None:
+                self.alive &= self.xp >= instr.value
+            self.xp[:] = 0
+        elif instr.travel:
+            self.travel(instr)
+        elif instr.event:
+            formid = instr.formation.formid
+            for row in numpy.flatnonzero(self.alive).tolist():
+                self.events[row].append((LOG_EVENT, formid))
+                if formid < 0x200:
+                    self.seen[row] |= 1 << formid
+            self.increment_battle(numpy.flatnonzero(self.alive))
+            self.overworld_threatrate[:] = NO_THREATRATE
+        elif instr.random:
+            self.fight(numpy.flatnonzero(self.alive), instr.fset, LOG_RANDOM)
+            self.overworld_threatrate[:] = NO_THREATRATE
+        elif instr.weight:
+            self.weight = instr.weightval
+        self.scriptptr += 1
+
+    def priorities(self):
+        """
+        :return: Route.heuristic of every row at the current script position, as python numbers
+        """
+        lowerbound = self.route_class.lowerbounds[self.scriptptr]
+        return [self.scalar_cost(row) + (threat >> 12) + lowerbound for row, threat in enumerate(self.threat.tolist())]
+
+    def run(self, stops):
+        """
+        Executes instructions until the next one may branch.
+        :param stops: row -> script position to hand the row back at, rows missing from it are not handed back
+        :return: ( routes, history ) where routes are the routes handed back, updated to their script position and
+                 history has the script position, Route.heuristic of every row and the rows still alive before each
+                 instruction executed and at the branching point
+        """
+        script = self.route_class.script
+        routes = {}
+        history = []
+        while True:
+            alive = self.alive.copy()
+            history.append((self.scriptptr, self.priorities(), alive))
+            for row in numpy.flatnonzero(alive).tolist():
+                if stops.get(row) == self.scriptptr:
+                    routes[row] = self.materialise_row(row)
+                    self.alive[row] = False
+            if self.scriptptr >= len(script) or not self.alive.any():
+                break
+            instr = script[self.scriptptr]
+            if branches_at(script, self.scriptptr):
+                break
+            if instr.travel and self.menu_reset_possible(instr):
+                break
+            self.execute(instr)
+        return routes, history
+
+    def materialise_row(self, row):
+        """
+        :return: the row's Route updated to the current script position
+        """
+        route = self.routes[row]
+        route.scriptptr = self.scriptptr
+        route.weight = self.weight
+        route.stepseed = int(self.stepseed[row])
+        route.stepcounter = int(self.stepcounter[row])
+        route.battleseed = int(self.battleseed[row])
+        route.battlecounter = int(self.battlecounter[row])
+        route.threat = int(self.threat[row])
+        route.cost = self.scalar_cost(row)
+        route.xp = int(self.xp[row])
+        route.num_encounters = int(self.num_encounters[row])
+        route.boundary_flag = bool(self.boundary_flag[row])
+        threatrate = int(self.overworld_threatrate[row])
+        route.overworld_threatrate = None if threatrate == NO_THREATRATE else threatrate
+        route.seen_formations |= self.seen[row]
+        for event in self.events[row]:
+            route.log_event(*event)
+        return route
+
+
+def replay(history):
+    """
+    Works out how far a best-first search popping ( Route.heuristic, insertion order ) would have taken each row on
+    its own by the time it first expands a route at the branching point, so the search can carry on from exactly there.
+    :param history: returned by Lockstep.run
+    :return: ( stops, orders, expanded ) where stops maps each row still queued to its script position, orders maps
+             it to its place in the search's insertion order and expanded is the number of routes the search expanded
+    """
+    steps = dict((scriptptr, i) for i, (scriptptr, priorities, alive) in enumerate(history))
+    first, priorities, alive = history[0]
+    branching = history[-1][0]
+    queue = [(priorities[row], row, row, first) for row in numpy.flatnonzero(alive).tolist()]
+    heapify(queue)
+    order = len(alive)
+    expanded = 0
+    while queue and queue[0][3] != branching:
+        priority, _, row, scriptptr = heappop(queue)
+        expanded += 1
+        nextptr, priorities, alive = history[steps[scriptptr] + 1]
+        if alive[row]:
+            heappush(queue, (priorities[row], order, row, nextptr))
+            order += 1
+    stops = dict((row, scriptptr) for priority, order, row, scriptptr in queue)
+    orders = dict((row, order) for priority, order, row, scriptptr in queue)
+    return stops, orders, expanded
+
+
+def advance(routes, step_value):
+    """
+    Runs routes in lockstep up to the first instruction where the search may branch. Routes the search would not have
+    got that far with by the time it first branches are handed back where the search would have left them, so the
+    search expands exactly the same routes in the same order as it would have without lockstep.
+    :param routes: fresh Route objects, usually one per seed
+    :param step_value: the cost of a single step, encrouter.STEP_VALUE
+    :return: ( routes, expanded ), the routes which survived in the order the search would have queued them and the
+             number of expansions the search would have made to get them there. routes is returned unchanged with 0
+             expansions if the batch can not be run in lockstep
+    """
+    if not Lockstep.supported(routes):
+        return routes, 0
+    # the first run only finds out the costs along the way, the second stops each row where the search would have
+    unused, history = Lockstep(routes, step_value).run({})
+    stops, orders, expanded = replay(history)
+    advanced, unused = Lockstep(routes, step_value).run(stops)
+    return [advanced[row] for row in sorted(advanced, key=orders.get)], expanded
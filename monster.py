@@ -1,4 +1,5 @@
-from utils import hex2int, read_multi, ENEMY_TABLE
+from utils import hex2int, ENEMY_TABLE
+from struct import Struct
 import logging
 
 """
@@ -37,6 +38,9 @@ stat_order = ['speed', 'attack', 'hit%', 'evade%', 'mblock%',
               'def', 'mdef', 'mpow']
 """The first 8 bytes of a monster's data are apparently 1 byte each of these stat values in this order"""
 
+STATS = Struct("<8B4H4B")
+"""The 8 stat bytes, then hp, mp, xp and gp words, then level, morph, misc1 and misc2 bytes"""
+
 logging.basicConfig(filename="./logs/main.log", level=logging.DEBUG, format='%(asctime)s %(name)s %(levelname)s:%(message)s')
 logger = logging.getLogger(__name__)
 
@@ -90,60 +94,37 @@ class MonsterBlock:
         """
         self.moulds.add(mould)
 
-    def read_stats(self, filename):
+    def read_stats(self, rom):
         f"""
-        Reads the associated monster data starting with stats stored at L{self.pointer} from the given file.
+        Reads the associated monster data starting with stats stored at L{self.pointer} from the given rom.
         Then Reads associated itemdata for this monster at at L{self.itemptr}, control data at L{self.controlptr}
         sketch data at L{self.sketchptr}, and rage data at L{self.rageptr}, and ai data at L{self.aiptr}.
 
         The statuses, misc1, and misc2 fields appear to be bit arrays based on the bit masking being used.
-        :param filename:
+        :param rom: a rom.Rom
         :return:
         """
         global all_spells, valid_spells, items, itemids
 
-        f = open(filename, 'r+b')
-        f.seek(self.pointer)
-        for key in stat_order:
+        values = rom.unpack(STATS, self.pointer)
+        for key, value in zip(stat_order, values):
             # these stats are values <= 255
-            self.stats[key] = ord(f.read(1))
-        self.stats['hp'] = read_multi(f, length=2)
-        self.stats['mp'] = read_multi(f, length=2)
-        self.stats['xp'] = read_multi(f, length=2)
-        self.stats['gp'] = read_multi(f, length=2)
-        self.stats['level'] = ord(f.read(1))
-
-        self.morph = ord(f.read(1))
-        self.misc1 = ord(f.read(1))
-        self.misc2 = ord(f.read(1))
-
-        # the previous bytes read would result in us being 20 beyond the original starting place now
-        f.seek(self.pointer + 20)
-        self.immunities = list(f.read(3))
-        self.absorb = ord(f.read(1))
-        self.null = ord(f.read(1))
-        self.weakness = ord(f.read(1))
-
-        f.seek(self.pointer + 27)
-        self.statuses = list(f.read(4))
-        self.special = ord(f.read(1))
-
-        f.seek(self.itemptr)
-        self.items = list(f.read(4))
-
-        f.seek(self.controlptr)
-        self.controls = list(f.read(4))
-
-        f.seek(self.sketchptr)
-        self.sketches = list(f.read(2))
-
-        f.seek(self.rageptr)
-        self.rages = list(f.read(2))
-
-        f.seek(self.aiptr)
-        self.ai = read_multi(f, length=2)
-
-        f.close()
+            self.stats[key] = value
+        (self.stats['hp'], self.stats['mp'], self.stats['xp'], self.stats['gp'], self.stats['level'],
+         self.morph, self.misc1, self.misc2) = values[len(stat_order):]
+
+        # the stats record is 20 bytes long
+        self.immunities = rom.bytes(self.pointer + 20, 3)
+        self.absorb, self.null, self.weakness = rom.bytes(self.pointer + 23, 3)
+
+        self.statuses = rom.bytes(self.pointer + 27, 4)
+        self.special = rom.byte(self.pointer + 31)
+
+        self.items = rom.bytes(self.itemptr, 4)
+        self.controls = rom.bytes(self.controlptr, 4)
+        self.sketches = rom.bytes(self.sketchptr, 2)
+        self.rages = rom.bytes(self.rageptr, 2)
+        self.ai = rom.word(self.aiptr)
 
     @property
     def humanoid(self):
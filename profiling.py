@@ -0,0 +1,205 @@
+from contextlib import contextmanager, nullcontext
+from os import path, makedirs
+import cProfile
+import pstats
+import sys
+import threading
+import time
+
+"""
+Profiles the phases of an encrouter.py run ( loading the rom and route file, then searching ) on their own.
+
+With cProfile each phase is written to <directory>/<phase>.pstats, which can be opened with python3 -m pstats or any
+pstats viewer, and summary.txt lists the time spent in each module of the repo and the slowest functions of each phase.
+The calls into the debug loggers, which do nothing while ALLOW_DEBUG_LOGGING is off but still show up everywhere, are
+counted as their own group so they are easy to tell apart from real work.
+
+The sampler is a thread which looks at the stack of the main thread every SAMPLE_INTERVAL seconds. It slows the search
+down far less than cProfile and counts time spent inside a function rather than calls, so it can be left on for a long
+run. Its samples are written to <directory>/<phase>.samples.txt as collapsed stacks ( "a;b;c count" lines, the input
+of flamegraph.pl and speedscope ) and summarised in summary.txt.
+"""
+
+MODES = ("cprofile", "sample", "both")
+SAMPLE_INTERVAL = 0.005
+REPO_DIR = path.dirname(path.abspath(__file__))
+LOGGER_FUNCTIONS = {"log", "lqueue", "route", "context_logger", "log_info", "get_queue_other_items"}
+"""The functions of encrouter.py which belong to MethodContextLogger, NullLogger and the logging helpers"""
+
+
+def group(filename, funcname):
+    """
+    :param filename: the file a profiled function is in, "~" for builtins
+    :param funcname: the function's name
+    :return: the name of the group its time is counted under in the summary
+    """
+    if filename == "~":
+        return "builtins"
+    directory, name = path.split(path.abspath(filename))
+    if directory == REPO_DIR and name.endswith(".py"):
+        module = name[:-3]
+        if module == "encrouter" and funcname in LOGGER_FUNCTIONS:
+            return "encrouter logging"
+        return module
+    if path.basename(directory) == "logging":
+        return "logging"
+    return "other"
+
+
+def label(filename, lineno, funcname):
+    if filename == "~":
+        return funcname
+    return "%s:%s(%s)" % (path.basename(filename), lineno, funcname)
+
+
+class Sampler(threading.Thread):
+    """
+    Counts the stacks of a thread every interval seconds until stop is called
+    """
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = {} # tuple of ( filename, lineno, funcname ) from the outermost call -> samples
+        self.running = threading.Event()
+        self.running.set()
+
+    def run(self):
+        # sleep first so the thread starting this one is not caught waiting for it
+        while True:
+            time.sleep(self.interval)
+            if not self.running.is_set():
+                break
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                frame = frame.f_back
+            if stack:
+                stack = tuple(reversed(stack))
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def stop(self):
+        self.running.clear()
+        self.join()
+
+
+class Profiler:
+
+    def __init__(self, directory, mode="cprofile", top=30):
+        """
+        :param directory: where the profiles and summary are written
+        :param mode: one of MODES
+        :param top: the number of functions listed for each phase in the summary
+        """
+        if mode not in MODES:
+            raise ValueError("profile mode must be one of %s, not %s" % (", ".join(MODES), mode))
+        self.directory = directory
+        self.mode = mode
+        self.top = top
+        self.phases = [] # ( name, seconds, pstats.Stats or None, Sampler or None )
+        makedirs(directory, exist_ok=True)
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Profiles the code run inside the with block as the phase name. The profile is written and the summary
+        rewritten when the block ends, even if it raises.
+        """
+        profile = cProfile.Profile() if self.mode in ("cprofile", "both") else None
+        sampler = Sampler(threading.get_ident()) if self.mode in ("sample", "both") else None
+        if sampler is not None:
+            sampler.start()
+        start = time.perf_counter()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+            seconds = time.perf_counter() - start
+            if sampler is not None:
+                sampler.stop()
+            stats = None
+            if profile is not None:
+                profile.dump_stats(path.join(self.directory, "%s.pstats" % name))
+                stats = pstats.Stats(profile)
+            if sampler is not None:
+                self.write_samples(name, sampler)
+            self.phases.append((name, seconds, stats, sampler))
+            self.write_summary()
+
+    def write_samples(self, name, sampler):
+        with open(path.join(self.directory, "%s.samples.txt" % name), "w") as f:
+            for stack, count in sorted(sampler.stacks.items(), key=lambda item: -item[1]):
+                f.write("%s %s\n" % (";".join(label(*frame) for frame in stack), count))
+
+    def write_summary(self):
+        with open(path.join(self.directory, "summary.txt"), "w") as f:
+            for name, seconds, stats, sampler in self.phases:
+                f.write("%s phase: %.3f seconds\n\n" % (name, seconds))
+                if stats is not None:
+                    self.write_profile_summary(f, stats)
+                if sampler is not None:
+                    self.write_sample_summary(f, sampler)
+        print("Wrote profile of %s to %s" % (", ".join(p[0] for p in self.phases), self.directory))
+
+    def write_profile_summary(self, f, stats):
+        """
+        Time spent in the functions of each group then the top functions by own time and by cumulative time
+        """
+        groups = {}
+        rows = []
+        for (filename, lineno, funcname), (cc, nc, tt, ct, callers) in stats.stats.items():
+            name = group(filename, funcname)
+            calls, own = groups.get(name, (0, 0.0))
+            groups[name] = (calls + nc, own + tt)
+            rows.append((tt, ct, nc, name, label(filename, lineno, funcname)))
+        total = sum(own for calls, own in groups.values()) or 1
+        f.write("cProfile own time by module\n")
+        f.write("%-20s %12s %10s %7s\n" % ("module", "calls", "seconds", "share"))
+        for name, (calls, own) in sorted(groups.items(), key=lambda item: -item[1][1]):
+            f.write("%-20s %12s %10.3f %6.1f%%\n" % (name, calls, own, own / total * 100))
+        for title, index in (("own time", 0), ("cumulative time", 1)):
+            f.write("\nTop %s functions by %s\n" % (self.top, title))
+            f.write("%10s %10s %12s  %-20s %s\n" % ("own s", "cum s", "calls", "module", "function"))
+            for tt, ct, nc, name, function in sorted(rows, key=lambda row: -row[index])[:self.top]:
+                f.write("%10.3f %10.3f %12s  %-20s %s\n" % (tt, ct, nc, name, function))
+        f.write("\n")
+
+    def write_sample_summary(self, f, sampler):
+        """
+        Share of the samples spent in each group and function, counting only the innermost function of each sample
+        """
+        total = sum(sampler.stacks.values()) or 1
+        groups = {}
+        functions = {}
+        for stack, count in sampler.stacks.items():
+            filename, lineno, funcname = stack[-1]
+            name = group(filename, funcname)
+            groups[name] = groups.get(name, 0) + count
+            key = (name, label(filename, lineno, funcname))
+            functions[key] = functions.get(key, 0) + count
+        f.write("Sampled time by module ( %s samples every %s seconds )\n" % (total, sampler.interval))
+        f.write("%-20s %10s %7s\n" % ("module", "samples", "share"))
+        for name, count in sorted(groups.items(), key=lambda item: -item[1]):
+            f.write("%-20s %10s %6.1f%%\n" % (name, count, count / total * 100))
+        f.write("\nTop %s functions by samples\n" % self.top)
+        f.write("%10s %7s  %-20s %s\n" % ("samples", "share", "module", "function"))
+        for (name, function), count in sorted(functions.items(), key=lambda item: -item[1])[:self.top]:
+            f.write("%10s %6.1f%%  %-20s %s\n" % (count, count / total * 100, name, function))
+        f.write("\n")
+
+
+def profile_phase(profiler, name):
+    """
+    :param profiler: a Profiler or None when not profiling
+    :param name: the name of the phase
+    :return: a context manager which profiles its block as the phase name, or does nothing without a profiler
+    """
+    if profiler is None:
+        return nullcontext()
+    return profiler.phase(name)
@@ -0,0 +1,219 @@
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from datetime import datetime
+from io import StringIO
+from multiprocessing import get_context
+from os import path, makedirs
+from sys import argv, exit
+import json
+import platform
+import tempfile
+import time
+
+from encrouter import Route, NoSolutionsError, load_rom_data, encounter_search, initial_routes, pop_option
+from searchstats import SearchStats
+from snapshot import file_hash
+from synthrom import ROUTE_FILES, synthetic_rom
+from travelog import formation_records
+try:
+    import resource
+except ImportError:
+    # not available on windows, peak memory is not reported
+    resource = None
+
+"""
+End to end runs of encounter_search over the route files shipped with the repo.
+
+Each route file is searched in a fresh process the same way encrouter.py searches it, for a few seeds, and the wall
+time, nodes expanded, peak fringe size and peak resident memory of the run are recorded. The solutions found ( seed,
+cost and the formations fought ) are compared with the golden results stored in golden/<rom sha1>/<route file>.json, so
+a change to the search can be checked to still find exactly the same routes. --update writes the golden results
+instead. Without --rom the synthetic rom written by synthrom.py is used.
+
+usage: python3 regression.py [--rom FILE] [--routes FILE,FILE...] [--seeds N,N...|all] [--golden DIR]
+                             [--output FILE] [--maxsize N] [--update]
+"""
+
+DEFAULT_SEEDS = [5, 17, 244]
+"""Every shipped route file finds 2 solutions for each of these seeds with the synthetic rom"""
+DEFAULT_GOLDEN = "golden"
+DEFAULT_OUTPUT = "regression.json"
+MAXSIZE = 10000
+"""The fringe size encrouter.py prunes to"""
+
+
+def peak_rss():
+    """
+    :return: the peak resident memory of this process in bytes, None if it can not be read
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return peak if platform.system() == "Darwin" else peak * 1024
+
+
+def solution_record(solution):
+    """
+    :param solution: a Route at the end of the script
+    :return: dict of what must not change about the solution
+    """
+    return {
+        "seed": solution.initialseed,
+        "cost": solution.cost,
+        "encounters": formation_records(solution.log_tail, Route.formations),
+    }
+
+
+def run_route(filename, routefile, seeds, maxsize):
+    """
+    Searches routefile for seeds the way encrouter.py does. Runs in its own process so the rom data loaded for one
+    route file and the memory used by its search do not carry over to the next one.
+    :return: dict of the measurements and solution records
+    """
+    start = time.perf_counter()
+    rng = load_rom_data(filename, routefile)
+    loaded = time.perf_counter()
+    routes, expanded = initial_routes(rng, seeds)
+    stats = SearchStats()
+    output = StringIO()
+    with redirect_stdout(output):
+        try:
+            solutions = encounter_search(routes, number=20, anynode=False, maxsize=maxsize, stats=stats,
+                                         expanded=expanded)
+        except NoSolutionsError:
+            solutions = []
+    finished = time.perf_counter()
+    return {
+        "load_seconds": loaded - start,
+        "search_seconds": finished - loaded,
+        "nodes_expanded": stats.nodes_expanded,
+        "peak_fringe": stats.peak_fringe,
+        "routes_merged": stats.routes_merged,
+        "peak_rss": peak_rss(),
+        "pruned": stats.pruned,
+        "instructions": stats.as_dict()["instructions"],
+        "solutions": [solution_record(s) for s in solutions],
+    }
+
+
+def golden_path(golden, romhash, routefile):
+    return path.join(golden, romhash, "%s.json" % routefile)
+
+
+def describe(record):
+    return "seed %s cost %s: %s" % (record["seed"], record["cost"],
+                                    ", ".join("%s %x" % (e["kind"], e["formid"]) for e in record["encounters"]))
+
+
+def differences(expected, actual):
+    """
+    :param expected: list of golden solution records
+    :param actual: list of solution records found now
+    :return: list of lines describing how actual differs from expected, empty if they are the same
+    """
+    lines = []
+    if len(expected) != len(actual):
+        lines.append("expected %s solutions, found %s" % (len(expected), len(actual)))
+    for i, (before, after) in enumerate(zip(expected, actual)):
+        if before != after:
+            lines.append("solution %s differs" % (i + 1))
+            lines.append("  golden: %s" % describe(before))
+            lines.append("  found:  %s" % describe(after))
+    for i, before in enumerate(expected[len(actual):], len(actual)):
+        lines.append("solution %s missing: %s" % (i + 1, describe(before)))
+    for i, after in enumerate(actual[len(expected):], len(expected)):
+        lines.append("solution %s extra: %s" % (i + 1, describe(after)))
+    return lines
+
+
+def check_golden(filename, seeds, solutions, update):
+    """
+    :param filename: the golden result file
+    :param seeds: the seeds which were searched
+    :param solutions: the solution records found
+    :param update: write solutions as the golden result instead of comparing with it
+    :return: ( status, list of lines explaining the status )
+    """
+    if not solutions:
+        # every shipped route file can be completed, a search finding nothing is broken whatever the golden result says
+        return "no solutions", ["no solutions found for seeds %s" % " ".join(map(str, seeds))]
+    if update:
+        makedirs(path.dirname(filename), exist_ok=True)
+        with open(filename, "w") as f:
+            json.dump({"seeds": seeds, "solutions": solutions}, f, indent=1)
+            f.write("\n")
+        return "updated", []
+    if not path.exists(filename):
+        return "no golden", ["%s does not exist, run with --update to create it" % filename]
+    with open(filename) as f:
+        golden = json.load(f)
+    if golden["seeds"] != seeds:
+        return "no golden", ["%s was made for seeds %s" % (filename, " ".join(map(str, golden["seeds"])))]
+    if not golden["solutions"]:
+        # made before empty results were refused, it would only check that nothing is found
+        return "no golden", ["%s has no solutions, run with --update to replace it" % filename]
+    lines = differences(golden["solutions"], solutions)
+    return ("differs" if lines else "same"), lines
+
+
+def run(args):
+    rom = pop_option(args, "--rom")
+    routefiles = pop_option(args, "--routes")
+    routefiles = ROUTE_FILES if routefiles is None else routefiles.split(",")
+    seeds = pop_option(args, "--seeds")
+    if seeds is None:
+        seeds = DEFAULT_SEEDS
+    elif seeds == "all":
+        seeds = list(range(0x100))
+    else:
+        seeds = [int(seed) for seed in seeds.split(",")]
+    golden = pop_option(args, "--golden", DEFAULT_GOLDEN)
+    output = pop_option(args, "--output", DEFAULT_OUTPUT)
+    maxsize = int(pop_option(args, "--maxsize", MAXSIZE))
+    update = "--update" in args
+
+    results = {}
+    failed = False
+    with tempfile.TemporaryDirectory() as directory:
+        if rom is None:
+            filename = path.join(directory, "synthetic.smc")
+            synthetic_rom(filename)
+        else:
+            filename = rom
+        romhash = file_hash(filename)
+
+        print("%-30s %9s %9s %10s %10s %10s %6s  %s" % ("route", "load s", "search s", "expanded", "peak queue",
+                                                         "peak MB", "found", "golden"))
+        for routefile in routefiles:
+            # a new process per route file so peak memory is measured for that route file alone
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+                result = executor.submit(run_route, filename, routefile, seeds, maxsize).result()
+            status, lines = check_golden(golden_path(golden, romhash, routefile), seeds, result["solutions"], update)
+            failed = failed or status in ("differs", "no golden", "no solutions")
+            result["golden"] = status
+            results[routefile] = result
+            print("%-30s %9.2f %9.2f %10s %10s %10s %6s  %s" % (
+                routefile, result["load_seconds"], result["search_seconds"], result["nodes_expanded"],
+                result["peak_fringe"], "-" if result["peak_rss"] is None else "%.1f" % (result["peak_rss"] / 2 ** 20),
+                len(result["solutions"]), status))
+            for line in lines:
+                print("    %s" % line)
+
+    with open(output, "w") as f:
+        json.dump({
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "rom": rom or "synthetic",
+            "rom_sha1": romhash,
+            "seeds": seeds,
+            "maxsize": maxsize,
+            "results": results,
+        }, f, indent=2)
+    print("Wrote %s" % output)
+    return not failed
+
+
+if __name__ == "__main__":
+    if not run(list(argv)):
+        exit(1)
@@ -0,0 +1,140 @@
+from locale import getpreferredencoding
+import gzip
+import json
+import zlib
+from travelog import formation_records
+
+"""
+Writes the solutions found by encrouter.encounter_search as soon as each one is accepted, so a long all seed run has a
+usable report before it finishes and finished routes do not have to be kept in memory.
+
+The text report has the same format as always. A JSON Lines report can be written next to it with one object per
+solution holding the seed, cost and the formations fought. Either file is gzip compressed when its name ends in .gz.
+"""
+
+
+def open_output(filename):
+    """
+    :param filename: the file to write, gzip compressed if it ends in .gz
+    :return: a text mode file object
+    """
+    if filename.endswith(".gz"):
+        return gzip.open(filename, "wt")
+    return open(filename, "w+")
+
+
+def read_output(filename):
+    """
+    :param filename: a file written with open_output
+    :return: its text, as much of it as can be read if the program writing it was stopped
+    """
+    if filename.endswith(".gz"):
+        # a gzip file whose writer was killed has no end marker, but everything flushed before that can still be read
+        with open(filename, "rb") as f:
+            data = zlib.decompressobj(zlib.MAX_WBITS | 16).decompress(f.read())
+        return data.decode(getpreferredencoding(False), "ignore")
+    with open(filename) as f:
+        return f.read()
+
+
+class Report:
+    """
+    Files are only created when the first solution is written, so a search without solutions leaves no report behind.
+    """
+
+    def __init__(self, filename, jsonfile=None, formations=None):
+        """
+        :param filename: the text report ie: report.txt
+        :param jsonfile: the JSON Lines report or None to only write text
+        :param formations: dict of formid to Formation used to label formations, Route.formations
+        """
+        self.filename = filename
+        self.jsonfile = jsonfile
+        self.formations = formations
+        self.text = None
+        self.json = None
+        self.written = 0
+        self.lengths = [0, 0] # characters written to the text and JSON Lines reports
+
+    def write(self, solution):
+        """
+        Writes a solution to every report and flushes them
+        :param solution: a Route at the end of the script
+        :return: None
+        """
+        if self.text is None:
+            self.text = open_output(self.filename)
+            if self.jsonfile is not None:
+                self.json = open_output(self.jsonfile)
+        shared_seeds = solution.shared_seeds
+        text = "INITIAL SEED: %s\n" % solution.initialseed
+        if shared_seeds:
+            text += "SAME ROUTE FROM SEEDS: %s\n" % " ".join(map(str, shared_seeds))
+        text += solution.travelog + "\n"
+        text += str(solution) + "\n\n"
+        text += "-" * 60 + "\n"
+        self.text.write(text)
+        self.text.flush()
+        self.lengths[0] += len(text)
+        if self.json is not None:
+            record = {
+                "seed": solution.initialseed,
+                "shared_seeds": shared_seeds,
+                "cost": solution.cost,
+                "num_encounters": solution.num_encounters,
+                "encounters": formation_records(solution.log_tail, self.formations),
+            }
+            line = json.dumps(record) + "\n"
+            self.json.write(line)
+            self.json.flush()
+            self.lengths[1] += len(line)
+        self.written += 1
+
+    def state(self):
+        """
+        :return: how much has been written, for resume
+        """
+        return (self.written, self.lengths[0], self.lengths[1])
+
+    def resume(self, state):
+        """
+        Carries on reports written by an earlier run up to state, dropping anything the earlier run wrote after it
+        :param state: returned by state
+        :return: None
+        """
+        self.written, textlength, jsonlength = state
+        if not self.written:
+            return
+        files = [(self.filename, textlength)]
+        if self.jsonfile is not None:
+            files.append((self.jsonfile, jsonlength))
+        kept = []
+        for filename, length in files:
+            try:
+                text = read_output(filename)[:length]
+            except FileNotFoundError:
+                text = ""
+            if len(text) < length:
+                raise ValueError("%s is shorter than when the checkpoint was written" % filename)
+            kept.append(text)
+        self.text = open_output(self.filename)
+        self.text.write(kept[0])
+        self.text.flush()
+        if self.jsonfile is not None:
+            self.json = open_output(self.jsonfile)
+            self.json.write(kept[1])
+            self.json.flush()
+        self.lengths = [textlength, jsonlength]
+
+    def close(self):
+        for f in (self.text, self.json):
+            if f is not None:
+                f.close()
+        self.text = None
+        self.json = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,125 @@
+from rng import BattleRNG
+
+"""
+Lete River outcomes for encrouter.Route.get_best_river, worked out from the river tables instead of simulated for every
+route which reaches a lete instruction.
+
+Going to the returner save point turns the route's seed into a lete seed ( tables/leterng.txt ) and every returner
+choice moves it along tables/returnerrng.txt. The river is taken with the first seed along that chain which gives the
+wanted number of fights ( tables/leteriver.txt ), which only depends on the route's seed. The formations fought on the
+river then only depend on that seed and the battle rng state the route enters the river with.
+"""
+
+RIVER_SETS = [0x107, 0x108, 0x107, 0x107, 0x108, 0x107, 0x108, 0x108, 0x107]
+"""The formation set of each possible fight on the river"""
+
+
+def table_from_file(filename, hexify=False):
+    table = {}
+    for line in open(filename):
+        line = line.strip()
+        if line[0] == '#':
+            continue
+        while '  ' in line:
+            line = line.replace('  ', ' ')
+        a, b = tuple(line.split())
+        if hexify:
+            try:
+                a = int(a, 0x10)
+                b = int(b, 0x10)
+            except ValueError:
+                continue
+        table[a] = b
+    return table
+
+
+def load_tables():
+    """
+    Reads the lete river tables
+    :return: ( riversequence, leterng, returnerrng ) for LeteRiver
+    """
+    sequence = open("tables/leteriver.txt").readlines()
+    sequence = [s.strip() for s in sequence]
+    sequence = [True if s == "fight" else False for s in sequence]
+    assert len(sequence) == 0x100
+    riversequence = {}
+    for i in range(0x100):
+        subseq = [True, True] + sequence[i:i+7]
+        riversequence[i] = subseq
+
+    leterng = table_from_file("tables/leterng.txt", hexify=True)
+    assert 2 in leterng
+    returnerrng = table_from_file("tables/returnerrng.txt", hexify=True)
+    return riversequence, leterng, returnerrng
+
+
+class LeteRiver:
+    """
+    Lete seeds picked for every route seed, built once per rom, and river formations for each battle rng state, built
+    the first time a state is reached.
+    """
+
+    def __init__(self, riversequence, leterng, returnerrng, battlerng, fsets):
+        """
+        :param riversequence: Route.riversequence, seed -> list of fight / no fight decisions on the river
+        :param leterng: seed -> lete seed at the returner save point
+        :param returnerrng: lete seed -> lete seed after the next returner choice
+        :param battlerng: rng.BattleRNG
+        :param fsets: setid -> FormationSet
+        """
+        self.riversequence = riversequence
+        self.leterng = leterng
+        self.returnerrng = returnerrng
+        self.battlerng = battlerng
+        self.fsets = fsets
+        self.fights = dict((seed, sequence.count(True)) for seed, sequence in riversequence.items())
+        self.choices = {} # battles -> { route seed -> ( lete seed, returner steps, fights ) }
+        self.outcomes = {} # ( lete seed, battlecounter << 8 | battleseed ) -> ( formations, battlecounter, battleseed )
+
+    def choice_table(self, battles):
+        """
+        :param battles: the number of river fights wanted besides the 2 which always happen
+        :return: dict of route seed -> ( lete seed, returner steps, fights ) for every seed with such a lete seed
+                 within 0x100 returner steps
+        """
+        table = self.choices.get(battles)
+        if table is not None:
+            return table
+        table = {}
+        for routeseed, seed in self.leterng.items():
+            for steps in range(0x100):
+                if self.fights[seed] == 2 + battles:
+                    table[routeseed] = (seed, steps, self.fights[seed])
+                    break
+                seed = self.returnerrng[seed]
+        self.choices[battles] = table
+        return table
+
+    def choice(self, routeseed, battles):
+        """
+        :param routeseed: Route.seed when the route reaches the lete instruction
+        :param battles: the number of river fights wanted besides the 2 which always happen
+        :return: ( lete seed, returner steps, fights ) or None if no lete seed gives that many fights
+        """
+        return self.choice_table(battles).get(routeseed)
+
+    def outcome(self, seed, battlecounter, battleseed):
+        """
+        :param seed: the lete seed the river is taken with
+        :param battlecounter: the route's battlecounter entering the river
+        :param battleseed: the route's battleseed entering the river
+        :return: ( formations fought in order, battlecounter, battleseed after the river )
+        """
+        key = (seed, battlecounter << 8 | battleseed)
+        outcome = self.outcomes.get(key)
+        if outcome is not None:
+            return outcome
+        formations = []
+        for decision, setid in zip(self.riversequence[seed], RIVER_SETS):
+            if decision:
+                fset = self.fsets[setid]
+                battlecounter, battleseed = BattleRNG.advance(battlecounter, battleseed)
+                formations.append(fset.formations[self.battlerng.slot(battlecounter, battleseed, len(fset.formations))])
+        outcome = (formations, battlecounter, battleseed)
+        self.outcomes[key] = outcome
+        return outcome
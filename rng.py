@@ -0,0 +1,139 @@
+from array import array
+from bisect import bisect_left
+
+"""
+Precomputed views of the 256 byte RNG table read from the rom at 0xFD00 by encrouter.get_rng_string.
+
+Step RNG: each step increments the step counter ( rolling the step seed by 0x11 when the counter wraps to 0 ) and a
+battle happens when (rng[stepcounter] + stepseed) & 0xFF < threat >> 8. Between two battles the threat grows by the
+same threat rate every step, so for a step k steps ahead of the current state:
+
+    battle at step k  <=>  (rng_k + 1) * 0x100 - k * threatrate <= threat
+
+The left hand side only depends on (stepcounter, stepseed, threatrate) so the first battle is the first k where the
+running minimum of that sequence drops to the current threat, which is a binary search over a cached table.
+"""
+
+STEP_SEED_INCREMENT = 0x11
+WINDOW = 0x100
+
+
+class StepRNG:
+    """
+    Answers "how many steps until the next battle" for a given rng table without simulating each step.
+    Tables are built lazily per (stepcounter, stepseed, threatrate) and shared by every route using the same rng.
+    """
+
+    def __init__(self, rng, maxtables=0x4000):
+        """
+        :param rng: the 256 values from encrouter.get_rng_string
+        :param maxtables: the number of cached tables kept before the cache is cleared. Each table is about 1KB
+        """
+        self.rng = rng
+        self.maxtables = maxtables
+        self.tables = {}
+
+    def table(self, stepcounter, stepseed, threatrate):
+        """
+        Builds the negated running minimum of (rng_k + 1) * 0x100 - k * threatrate for the next WINDOW steps.
+        Negated so that the table is ascending and can be searched with bisect.
+        """
+        # a tuple rather than packed bits since route files can give any threat rate
+        key = (stepcounter, stepseed, threatrate)
+        table = self.tables.get(key)
+        if table is not None:
+            return table
+
+        if len(self.tables) >= self.maxtables:
+            self.tables.clear()
+        rng = self.rng
+        table = array('l')
+        best = None
+        seed = stepseed
+        for k in range(1, WINDOW + 1):
+            counter = (stepcounter + k) & 0xFF
+            if counter == 0:
+                seed = (seed + STEP_SEED_INCREMENT) & 0xFF
+            value = (((rng[counter] + seed) & 0xFF) + 1) * 0x100 - k * threatrate
+            if best is None or value < best:
+                best = value
+            table.append(-best)
+        self.tables[key] = table
+        return table
+
+    def steps_to_battle(self, stepcounter, stepseed, threat, threatrate, limit=None):
+        """
+        :param stepcounter: the current step counter
+        :param stepseed: the current step seed
+        :param threat: the current threat
+        :param threatrate: the threat added on every step
+        :param limit: the maximum number of steps to look at, None for no limit
+        :return: the number of steps taken up to and including the step with the next battle or None if there is
+                 no battle within limit steps
+        """
+        offset = 0
+        while limit is None or offset < limit:
+            table = self.table(stepcounter, stepseed, threatrate)
+            k = bisect_left(table, -threat)
+            if k < WINDOW:
+                k += 1
+                if limit is not None and offset + k > limit:
+                    return None
+                return offset + k
+            # a full window without a battle leaves the counter where it was with the seed rolled once
+            offset += WINDOW
+            stepseed = (stepseed + STEP_SEED_INCREMENT) & 0xFF
+            threat += WINDOW * threatrate
+        return None
+
+    @staticmethod
+    def advance(stepcounter, stepseed, steps):
+        """
+        :return: (stepcounter, stepseed) after taking steps steps
+        """
+        counter = stepcounter + steps
+        wraps = counter >> 8
+        return counter & 0xFF, (stepseed + STEP_SEED_INCREMENT * wraps) & 0xFF
+
+
+BATTLE_SEED_INCREMENT = 0x17
+
+
+class BattleRNG:
+    """
+    Formation slot outcomes for every battle RNG state, computed once per rom.
+    A state is the (battlecounter, battleseed) pair after the battle counter has been incremented and the tables are
+    indexed by battlecounter << 8 | battleseed.
+    """
+
+    def __init__(self, rng):
+        """
+        :param rng: the 256 values from encrouter.get_rng_string
+        """
+        self.rng = rng
+        # (rng[battlecounter] + battleseed) & 0xFF for every state
+        self.values = bytes((rng[counter] + seed) & 0xFF
+                            for counter in range(0x100) for seed in range(0x100))
+        # index into FormationSet.formations for sets of 4 ( setid <= 0xFF ) and sets of 2 formations
+        self.slots4 = bytes(value // 0x50 for value in self.values)
+        self.slots2 = bytes(value // 0xC0 for value in self.values)
+
+    def slot(self, battlecounter, battleseed, num_formations):
+        """
+        :return: the index of the formation picked from a set with num_formations formations
+        """
+        if num_formations == 4:
+            return self.slots4[battlecounter << 8 | battleseed]
+        return self.slots2[battlecounter << 8 | battleseed]
+
+    def value(self, battlecounter, battleseed):
+        return self.values[battlecounter << 8 | battleseed]
+
+    @staticmethod
+    def advance(battlecounter, battleseed, battles=1):
+        """
+        :return: (battlecounter, battleseed) after the battle counter has been incremented battles times
+        """
+        counter = battlecounter + battles
+        wraps = counter >> 8
+        return counter & 0xFF, (battleseed + BATTLE_SEED_INCREMENT * wraps) & 0xFF
@@ -0,0 +1,57 @@
+from struct import Struct
+
+"""
+Read only access to a rom file which is read from disk once.
+
+Everything the program needs from the rom ( monster stats, formations, formation sets and the rng table ) is decoded
+from this single buffer with struct rather than opening the file again and seeking for every record.
+"""
+
+WORD = Struct("<H")
+
+
+class Rom:
+    """
+    The contents of a rom file
+    """
+
+    def __init__(self, filename):
+        """
+        :param filename: the rom file
+        """
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            self.data = f.read()
+
+    def byte(self, pointer):
+        return self.data[pointer]
+
+    def bytes(self, pointer, length):
+        """
+        :return: list of length byte values starting at pointer
+        """
+        return list(self.data[pointer:pointer + length])
+
+    def word(self, pointer):
+        """
+        :return: the 2 byte little endian value at pointer, the same as utils.read_multi
+        """
+        return WORD.unpack_from(self.data, pointer)[0]
+
+    def unpack(self, layout, pointer):
+        """
+        :param layout: a struct.Struct
+        :param pointer: where the record starts
+        :return: tuple of the record's values
+        """
+        return layout.unpack_from(self.data, pointer)
+
+    def unpack_table(self, layout, pointer, count):
+        """
+        Decodes count records of layout stored one after the other
+        :param layout: a struct.Struct
+        :param pointer: where the first record starts
+        :param count: the number of records
+        :return: list of tuples of each record's values
+        """
+        return list(layout.iter_unpack(self.data[pointer:pointer + layout.size * count]))
@@ -0,0 +1,152 @@
+from os import replace
+from time import perf_counter
+import csv
+import json
+
+"""
+Counters for where encrouter.encounter_search spends its effort, kept when a SearchStats is passed to it.
+
+For every instruction type ( travel, veldt, event, random, lete, reset, force ... ) it counts the routes expanded at
+that instruction, the seconds spent in Route.expand and the children it made. It also counts the children per
+expansion, the routes expanded for each initial seed, the routes dropped by each pruning rule and samples the fringe
+size every 1000 expansions. The counters can be written as JSON, or as CSV when the file name ends in .csv, at the end of
+the search and every interval seconds while it runs, so an all seed run can be watched as it goes.
+"""
+
+PRUNE_RULES = {
+    "merged": "a child reached the same state as a queued route for no less cost",
+    "superseded": "a queued route was replaced by a cheaper route with the same state before it was expanded",
+    "behind": "dropped to keep the queue under maxsize, less than half way to the progress mark",
+    "same_signature": "dropped to keep the queue under maxsize, the seed already has a cheaper route at that position",
+    "extra_solution": "a solution of a seed which already has 2",
+}
+"""The pruning rules counted by SearchStats.prune"""
+
+
+class SearchStats:
+
+    def __init__(self, filename=None, interval=60):
+        """
+        :param filename: the file to write the counters to, None to only keep them in memory
+        :param interval: the seconds between writes while the search runs
+        """
+        self.filename = filename
+        self.interval = interval
+        self.started = perf_counter()
+        self.written = self.started
+        self.nodes_expanded = 0
+        self.peak_fringe = 0
+        self.routes_merged = 0
+        self.finished = False
+        self.instructions = {} # instruction type -> [ expansions, seconds, children ]
+        self.children = {} # children made by one expansion -> number of expansions
+        self.seeds = {} # initialseed -> routes expanded
+        self.pruned = dict((rule, 0) for rule in PRUNE_RULES)
+        self.fringe_sizes = [] # [ nodes expanded, seconds, fringe size, highest scriptptr ]
+
+    def expanded(self, route, kind, seconds, children, fringesize):
+        """
+        Counts one call of Route.expand
+        :param route: the route which was expanded
+        :param kind: the Instruction.type of the instruction it was expanded at
+        :param seconds: the time Route.expand took
+        :param children: the number of routes it returned
+        :param fringesize: the size of the fringe once the children were queued
+        :return: None
+        """
+        counts = self.instructions.get(kind)
+        if counts is None:
+            counts = self.instructions[kind] = [0, 0.0, 0]
+        counts[0] += 1
+        counts[1] += seconds
+        counts[2] += children
+        self.children[children] = self.children.get(children, 0) + 1
+        self.seeds[route.initialseed] = self.seeds.get(route.initialseed, 0) + 1
+        if fringesize > self.peak_fringe:
+            self.peak_fringe = fringesize
+
+    def prune(self, rule, count=1):
+        """
+        :param rule: a key of PRUNE_RULES
+        :param count: the number of routes it dropped
+        :return: None
+        """
+        self.pruned[rule] += count
+
+    def sample(self, counter, fringesize, highest):
+        """
+        Records the fringe size and writes the counters if interval seconds passed since they were last written
+        :param counter: the nodes expanded so far
+        :param fringesize: the size of the fringe
+        :param highest: the highest scriptptr reached
+        :return: None
+        """
+        now = perf_counter()
+        self.nodes_expanded = counter
+        self.fringe_sizes.append([counter, round(now - self.started, 3), fringesize, highest])
+        if self.filename is not None and now - self.written >= self.interval:
+            self.write()
+
+    def finish(self, counter, merged):
+        """
+        Records the final counts and writes the counters
+        :param counter: the nodes expanded
+        :param merged: TranspositionTable.merged
+        :return: None
+        """
+        self.nodes_expanded = counter
+        self.routes_merged = merged
+        self.finished = True
+        if self.filename is not None:
+            self.write()
+
+    def as_dict(self):
+        return {
+            "finished": self.finished,
+            "seconds": perf_counter() - self.started,
+            "nodes_expanded": self.nodes_expanded,
+            "peak_fringe": self.peak_fringe,
+            "routes_merged": self.routes_merged,
+            "instructions": dict((kind, {"expansions": n, "seconds": seconds, "children": children})
+                                 for kind, (n, seconds, children) in sorted(self.instructions.items())),
+            "children_per_expand": dict((str(n), count) for n, count in sorted(self.children.items())),
+            "pruned": dict(self.pruned),
+            "seeds": dict((str(seed), n) for seed, n in sorted(self.seeds.items())),
+            "fringe_sizes": self.fringe_sizes,
+        }
+
+    def rows(self):
+        """
+        :return: the counters as ( section, key, value, seconds ) rows for CSV
+        """
+        stats = self.as_dict()
+        rows = [("search", key, stats[key], "") for key in ("finished", "nodes_expanded", "peak_fringe",
+                                                             "routes_merged")]
+        rows.append(("search", "seconds", "", stats["seconds"]))
+        for kind, counts in stats["instructions"].items():
+            rows.append(("expansions", kind, counts["expansions"], counts["seconds"]))
+            rows.append(("children", kind, counts["children"], ""))
+        rows.extend(("children_per_expand", n, count, "") for n, count in stats["children_per_expand"].items())
+        rows.extend(("pruned", rule, count, "") for rule, count in stats["pruned"].items())
+        rows.extend(("seed", seed, n, "") for seed, n in stats["seeds"].items())
+        rows.extend(("fringe_size", counter, size, seconds) for counter, seconds, size, highest in stats["fringe_sizes"])
+        return rows
+
+    def write(self, filename=None):
+        """
+        Writes the counters, replacing the file
+        :param filename: defaults to the file given to the constructor, CSV if it ends in .csv else JSON
+        :return: None
+        """
+        filename = filename or self.filename
+        # written next to the file and renamed over it so the file is never seen half written
+        temporary = filename + ".tmp"
+        with open(temporary, "w", newline="") as f:
+            if filename.endswith(".csv"):
+                writer = csv.writer(f)
+                writer.writerow(("section", "key", "value", "seconds"))
+                writer.writerows(self.rows())
+            else:
+                json.dump(self.as_dict(), f, indent=1)
+        replace(temporary, filename)
+        self.written = perf_counter()
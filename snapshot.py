@@ -0,0 +1,85 @@
+from hashlib import sha1
+from os import path, makedirs, replace
+import pickle
+
+"""
+Caches everything encrouter.load_rom_data reads from the rom and the tables directory so later runs skip parsing it.
+
+A snapshot is a pickle of the monsters, formations, formation sets, rng string and lete river tables, stored as
+snapshots/<sha1 of the rom>.pickle. Each snapshot records the sha1 of the rom, of every table file and of the modules
+which decode them, and it is only used while all of those still match, so editing a table or the decoding code simply
+rebuilds it on the next run.
+"""
+
+SNAPSHOT_DIR = "snapshots"
+SNAPSHOT_VERSION = 1
+"""Increase when the snapshot contents change shape"""
+
+SOURCE_FILES = [path.join("tables", "enemycodes.txt"), path.join("tables", "customcosts.txt"),
+                path.join("tables", "leteriver.txt"), path.join("tables", "leterng.txt"),
+                path.join("tables", "returnerrng.txt"),
+                "rom.py", "monster.py", "formation.py", "river.py", "snapshot.py"]
+"""Files besides the rom which decide what a snapshot contains"""
+
+
+def file_hash(filename):
+    """
+    :param filename: a file
+    :return: hex sha1 digest of the file's contents
+    """
+    digest = sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(0x10000), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def snapshot_key(filename):
+    """
+    :param filename: the rom file
+    :return: tuple which changes whenever the rom or any of SOURCE_FILES changes
+    """
+    return (SNAPSHOT_VERSION, file_hash(filename)) + tuple((name, file_hash(name)) for name in SOURCE_FILES)
+
+
+def snapshot_path(key):
+    return path.join(SNAPSHOT_DIR, "%s.pickle" % key[1])
+
+
+def load_snapshot(filename):
+    """
+    :param filename: the rom file
+    :return: ( key, data ) where data is the dict saved by save_snapshot, or None if there is no snapshot for the
+             current rom and tables
+    """
+    key = snapshot_key(filename)
+    try:
+        with open(snapshot_path(key), 'rb') as f:
+            saved_key, data = pickle.load(f)
+    except FileNotFoundError:
+        return key, None
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, ValueError) as e:
+        print("Ignoring unreadable snapshot %s: %s" % (snapshot_path(key), e))
+        return key, None
+    if saved_key != key:
+        return key, None
+    return key, data
+
+
+def save_snapshot(key, data):
+    """
+    Writes the snapshot for key, replacing any older snapshot of the same rom. Failing to write it only costs the
+    next run the time to parse the rom again.
+    :param key: the key returned by load_snapshot
+    :param data: dict of the loaded rom data
+    :return: None
+    """
+    filename = snapshot_path(key)
+    temporary = filename + ".tmp"
+    try:
+        makedirs(SNAPSHOT_DIR, exist_ok=True)
+        with open(temporary, 'wb') as f:
+            pickle.dump((key, data), f, protocol=pickle.HIGHEST_PROTOCOL)
+        replace(temporary, filename)
+    except OSError as e:
+        print("Could not save snapshot %s: %s" % (filename, e))
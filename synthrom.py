@@ -0,0 +1,254 @@
+from random import Random
+from sys import argv
+from encrouter import pop_option
+from monster import STATS
+from formation import Formation, FormationSet, FORMATION, FORMATION_AUX, FSET4, FSET2
+from utils import ENEMY_TABLE, hex2int
+
+"""
+Writes synthetic roms which can stand in for the real one when benchmarking or regression testing the search, since the
+real rom can not be shipped with the repo.
+
+Everything the loaders read is filled in at the same offsets as the real rom: monster stats, items, controls, sketches,
+rages and ai at the pointers in tables/enemycodes.txt, the formations at 0xf6200 with their auxiliary data at 0xf5900,
+the formation sets at 0xf4800 and the rng table at 0xFD00. The rest of the file is zero.
+
+The data is random but shaped like the game's: monsters get stronger further down tables/enemycodes.txt, a formation
+holds one or two kinds of monster from the same part of the table, formation sets hold neighbouring formations, the
+formations after 0x200 and the formation sets after 0x100 are boss and event fights, and unnamed monsters are never
+used. The same seed always writes the same file.
+
+Random data alone can leave a shipped route file without any solution, so the rom is also made to fit them: a monster
+whose rage a route seeks on the veldt is put into the event formations the route fights before it, since the veldt
+only brings back formations which were already fought.
+
+usage: python3 synthrom.py FILE [--seed N]
+"""
+
+ROM_SIZE = 0x300000
+"""The size of an unheadered rom"""
+RNG_POINTER = 0xFD00
+NUM_FORMATIONS = 576
+NUM_FORMATION_SETS = 0x200
+BOSS_FORMATIONS = 0x200
+"""Formations from here on are boss and event fights"""
+ROUTE_FILES = ["route.short.txt", "route.txt", "route.txt.b6", "route.txt.b6.420", "route.txt.b6.noforce",
+               "route.txt.catscratch", "route.txt.lockefirst", "route.txt.lockefirst.noarmlet", "route.txt.yes52",
+               "lccroute.txt"]
+"""The route files shipped with the repo, every one of them can be completed with the synthetic rom"""
+
+
+def read_enemy_table():
+    """
+    :return: list of ( name, pointer, itemptr, controlptr, sketchptr, rageptr, aiptr ) for each line of
+             tables/enemycodes.txt, the name without its _ padding
+    """
+    enemies = []
+    for line in open(ENEMY_TABLE):
+        line = line.strip()
+        if not line or line[0] == '#':
+            continue
+        name, *pointers = line.split(',')
+        enemies.append(tuple([name.strip('_')] + [hex2int(p) for p in pointers]))
+    return enemies
+
+
+def route_rages(filenames):
+    """
+    :param filenames: route files
+    :return: dict of formid to the set of monster ids that event formation has to hold, the rages the route files seek
+             on the veldt after fighting it
+    """
+    rages = {}
+    for filename in filenames:
+        events = []
+        for line in open(filename):
+            parameters = line.split()
+            if not parameters or parameters[0][0] == '#':
+                continue
+            setid, threatrate, steps = parameters
+            if setid == "ev" and hex2int(steps) < BOSS_FORMATIONS:
+                events.append(hex2int(steps))
+            elif setid == "vl" and threatrate != "no":
+                for formid in events:
+                    rages.setdefault(formid, set()).add(hex2int(threatrate))
+    return rages
+
+
+def monster_stats(rand, eid):
+    """
+    :param rand: a random.Random
+    :param eid: the monster id, line of tables/enemycodes.txt
+    :return: the values of the monster's STATS record
+    """
+    boss = eid >= 0x100
+    level = min(99, max(1, (eid & 0xFF) * 60 // 0x100 + rand.randint(-3, 5) + (10 if boss else 0)))
+    stats = [
+        rand.randint(10, 40) + level // 2, # speed
+        rand.randint(5, 20) + level // 2, # attack
+        rand.randint(80, 160), # hit%
+        rand.choice([0, 0, 0, 10, 20, 30]), # evade%
+        rand.choice([0, 0, 0, 10, 20]), # mblock%
+        min(255, rand.randint(40, 100) + level * 2), # def
+        min(255, rand.randint(40, 100) + level * 2), # mdef
+        rand.randint(1, 10) + level // 6, # mpow
+    ]
+    hp = level * rand.randint(10, 40) + rand.randint(10, 60)
+    if boss:
+        hp *= rand.randint(5, 20)
+    xp = level * rand.randint(3, 10) if level > 1 else rand.randint(0, 3)
+    misc1 = ((0x10 if rand.random() < 0.15 else 0) | # humanoid
+             (0x80 if rand.random() < 0.1 else 0)) # undead
+    if boss:
+        misc2 = 0x08 if rand.random() < 0.8 else 0 # inescapable
+    else:
+        misc2 = rand.choice([0] * 16 + [0x01] * 3 + [0x08]) # escape difficult or inescapable
+    return stats + [
+        min(hp, 0xFFFF),
+        min(level * rand.randint(5, 15), 0xFFFF), # mp
+        min(xp * (3 if boss else 1), 0xFFFF),
+        min(xp * rand.randint(1, 3), 0xFFFF), # gp
+        level,
+        rand.randrange(0x20), # morph
+        misc1,
+        misc2,
+    ]
+
+
+def flags(rand, bits, chance):
+    """
+    :return: an int of bits bits each set with probability chance
+    """
+    return sum(1 << i for i in range(bits) if rand.random() < chance)
+
+
+def write_monsters(rom, rand, enemies):
+    """
+    :param rom: the bytearray to write into
+    :param rand: a random.Random
+    :param enemies: the list returned by read_enemy_table
+    :return: None
+    """
+    for eid, (name, pointer, itemptr, controlptr, sketchptr, rageptr, aiptr) in enumerate(enemies):
+        STATS.pack_into(rom, pointer, *monster_stats(rand, eid))
+        rom[pointer + 20:pointer + 23] = bytes(flags(rand, 8, 0.05) for _ in range(3)) # immunities
+        rom[pointer + 23:pointer + 26] = bytes(flags(rand, 8, 0.08) for _ in range(3)) # absorb, null, weakness
+        statuses = [flags(rand, 8, 0.03) for _ in range(4)]
+        if rand.random() < 0.1:
+            statuses[2] |= 0x01 # floating
+        rom[pointer + 27:pointer + 31] = bytes(statuses)
+        rom[pointer + 31] = rand.randrange(0x100) # special
+        rom[itemptr:itemptr + 4] = bytes(rand.choice([rand.randrange(0xFF), 0xFF]) for _ in range(4))
+        rom[controlptr:controlptr + 4] = bytes(rand.randrange(0x100) for _ in range(4))
+        rom[sketchptr:sketchptr + 2] = bytes(rand.randrange(0x100) for _ in range(2))
+        if eid < 0x100:
+            # the rage table only has an entry for the first 0x100 monsters, the pointers in the table after that
+            # land on the formation sets
+            rom[rageptr:rageptr + 2] = bytes(rand.randrange(0x100) for _ in range(2))
+        rom[aiptr:aiptr + 2] = rand.randrange(0x10000).to_bytes(2, "little")
+
+
+def formation_enemies(rand, formid, named, rages=()):
+    """
+    :param rand: a random.Random
+    :param formid: the formation id
+    :param named: sorted list of the ids of the monsters which have a name
+    :param rages: ids of monsters the formation has to hold
+    :return: list of 1 to 6 monster ids
+    """
+    regular = [eid for eid in named if eid < 0x100]
+    # the part of the monster table this formation's area takes its monsters from
+    centre = formid * len(regular) // BOSS_FORMATIONS if formid < BOSS_FORMATIONS else rand.randrange(len(regular))
+    nearby = regular[max(0, centre - 8):centre + 8]
+    kinds = [rand.choice(nearby) for _ in range(rand.choice([1, 1, 2, 2, 2, 3]))]
+    if formid >= BOSS_FORMATIONS:
+        kinds[0] = rand.choice([eid for eid in named if eid >= 0x100])
+    kinds = sorted(rages) + kinds[len(rages):]
+    count = rand.choice([1, 2, 2, 3, 3, 3, 4, 4, 5, 6]) if formid < BOSS_FORMATIONS else rand.randint(1, 3)
+    count = max(count, len(kinds))
+    return [kinds[i] if i < len(kinds) else rand.choice(kinds) for i in range(count)]
+
+
+def write_formations(rom, rand, named, rages):
+    """
+    :param rom: the bytearray to write into
+    :param rand: a random.Random
+    :param named: sorted list of the ids of the monsters which have a name
+    :param rages: dict returned by route_rages
+    :return: None
+    """
+    for formid in range(NUM_FORMATIONS):
+        formation = Formation(formid)
+        eids = formation_enemies(rand, formid, named, rages.get(formid, ()))
+        enemy_ids = [eid & 0xFF for eid in eids] + [0xFF] * (6 - len(eids))
+        positions = [rand.randrange(0x10) << 4 | rand.randrange(0x10) for _ in range(6)]
+        bosses = sum(1 << i for i, eid in enumerate(eids) if eid >= 0x100)
+        FORMATION.pack_into(rom, formation.pointer, rand.randrange(13) << 4, (1 << len(eids)) - 1,
+                            *enemy_ids, *positions, bosses)
+        # pincer, back and front attack prohibited
+        misc1 = rand.choice([0, 0, 0, 0x10, 0x20, 0x40, 0x40, 0x60]) if formid < BOSS_FORMATIONS else 0x60
+        misc2 = 0x80 if formid >= BOSS_FORMATIONS and rand.random() < 0.25 else 0 # has an event
+        FORMATION_AUX.pack_into(rom, formation.auxpointer, misc1, misc2, rand.randrange(0x100) if misc2 else 0,
+                                rand.randrange(0x100))
+
+
+def write_formation_sets(rom, rand):
+    """
+    :param rom: the bytearray to write into
+    :param rand: a random.Random
+    :return: None
+    """
+    for setid in range(NUM_FORMATION_SETS):
+        fset = FormationSet(setid)
+        if setid <= 0xFF:
+            # 4 neighbouring formations of one area, sometimes the same one twice
+            first = min(setid * BOSS_FORMATIONS // 0x100 + rand.randint(-2, 2), BOSS_FORMATIONS - 4)
+            first = max(first, 0)
+            formids = [first, first + rand.randint(0, 1), first + rand.randint(1, 2), first + rand.randint(1, 3)]
+            FSET4.pack_into(rom, fset.pointer, *formids)
+        else:
+            # the second half are mostly event fights
+            if rand.random() < 0.5:
+                first = rand.randrange(BOSS_FORMATIONS, NUM_FORMATIONS)
+                formids = [first, first]
+            else:
+                first = rand.randrange(BOSS_FORMATIONS - 1)
+                formids = [first, first + rand.randint(0, 1)]
+            FSET2.pack_into(rom, fset.pointer, *formids)
+
+
+def write_rng(rom, rand):
+    """
+    The rng table is a shuffle of every byte value
+    """
+    rng = list(range(0x100))
+    rand.shuffle(rng)
+    rom[RNG_POINTER:RNG_POINTER + 0x100] = bytes(rng)
+
+
+def synthetic_rom(filename, seed=0):
+    """
+    :param filename: the file to write
+    :param seed: seed for the random data, the same seed always writes the same rom
+    :return: None
+    """
+    rand = Random(seed)
+    rom = bytearray(ROM_SIZE)
+    enemies = read_enemy_table()
+    named = [eid for eid, enemy in enumerate(enemies) if enemy[0]]
+    write_monsters(rom, rand, enemies)
+    write_formations(rom, rand, named, route_rages(ROUTE_FILES))
+    write_formation_sets(rom, rand)
+    write_rng(rom, rand)
+    with open(filename, "wb") as f:
+        f.write(rom)
+
+
+if __name__ == "__main__":
+    args = list(argv)
+    seed = int(pop_option(args, "--seed", 0))
+    if len(args) < 2:
+        print("usage: python3 synthrom.py FILE [--seed N]")
+    else:
+        synthetic_rom(args[1], seed)
+        print("Wrote %s" % args[1])
@@ -0,0 +1,129 @@
+"""
+Transposition table for encrouter.encounter_search.
+
+Two routes at the same point of the script with the same rng state, threat and counters make exactly the same choices
+and pay exactly the same costs from there on, whatever their initial seed and however they got there. The table maps
+that state to the cheapest route seen with it so only one of them is expanded.
+
+Every route admitted to the table gets a set of the initial seeds merged into its state, chained onto the sets of its
+ancestors through Route.shared. Seeds merged into a state after the route was expanded still reach its descendants
+since they share the same set.
+"""
+
+
+def chain_seeds(shared):
+    """
+    :param shared: a Route.shared chain of ( parent, set of initial seeds ) or None
+    :return: set of every initial seed in the chain
+    """
+    seeds = set([])
+    while shared is not None:
+        shared, merged = shared
+        seeds.update(merged)
+    return seeds
+
+
+class TranspositionTable:
+
+    def __init__(self, script):
+        """
+        :param script: Route.script, used to find out where seen formations still matter
+        """
+        # seen formations only change veldt encounters so they are only part of the state while a veldt is ahead
+        self.veldt_ahead = [False] * (len(script) + 1)
+        for i in range(len(script) - 1, -1, -1):
+            self.veldt_ahead[i] = script[i].veldt or self.veldt_ahead[i + 1]
+        # scriptptr -> { state -> [ priority, route id, initial seed, route.shared ] } of the cheapest routes
+        self.states = {}
+        self.superseded = set([]) # ( id, scriptptr ) of routes in the fringe which a cheaper route has replaced
+        self.merged = 0
+
+    def state(self, route):
+        """
+        :param route: a Route
+        :return: the part of the route's state which decides its future
+        """
+        if route.last_forced_encounter is None:
+            force_value = None
+        else:
+            force_value = route.num_encounters - route.last_forced_encounter
+        if route.last_reset is None:
+            reset_value = None
+        else:
+            reset_value = route.num_encounters - route.last_reset
+        if self.veldt_ahead[route.scriptptr]:
+            seen = route.seen_formations
+        else:
+            seen = None
+        return (route.scriptptr, route.stepcounter, route.stepseed, route.battlecounter, route.battleseed,
+                route.seed, route.veldtseed, route.threat, route.overworld_threatrate, route.boundary_flag,
+                force_value, reset_value, route.xp, route.weight, route.smokebombs, route.gau_encounters, seen)
+
+    def admit(self, route, priority):
+        """
+        Records route in the table
+        :param route: a Route about to be added to the fringe
+        :param priority: the route's priority in the fringe
+        :return: True if route should be added to the fringe, False if a route with the same state and the same or
+                 lower priority is already known and route was merged into it
+        """
+        key = self.state(route)
+        states = self.states.get(route.scriptptr)
+        if states is None:
+            states = self.states[route.scriptptr] = {}
+        entry = states.get(key)
+        if entry is not None and entry[0] <= priority:
+            merged = entry[3][1]
+            merged.add(route.initialseed)
+            merged.update(chain_seeds(route.shared))
+            self.merged += 1
+            return False
+
+        merged = set([])
+        if entry is not None:
+            # the route already in the fringe for this state is beaten and is dropped when it is popped
+            self.superseded.add((entry[1], key[0]))
+            merged.add(entry[2])
+            merged.update(chain_seeds(entry[3]))
+            self.merged += 1
+        route.shared = (route.shared, merged)
+        states[key] = [priority, route.id, route.initialseed, route.shared]
+        return True
+
+    def superseded_route(self, route):
+        """
+        :param route: a Route popped from the fringe
+        :return: True if a cheaper route with the same state was admitted after route so route should be skipped
+        """
+        node = (route.id, route.scriptptr)
+        if node in self.superseded:
+            self.superseded.discard(node)
+            return True
+        return False
+
+    def forget(self, route):
+        """
+        Removes route from the table when the fringe drops it so the next route reaching its state is not merged into
+        a route which will never be expanded.
+        :param route: a Route removed from the fringe without being expanded
+        :return: None
+        """
+        self.superseded.discard((route.id, route.scriptptr))
+        states = self.states.get(route.scriptptr, {})
+        key = self.state(route)
+        entry = states.get(key)
+        if entry is not None and entry[1] == route.id:
+            del states[key]
+
+    def forget_before(self, scriptptr):
+        """
+        Drops every state before scriptptr in the script. Routes only move forward through the script so once no
+        route in the fringe is before scriptptr those states can not be reached again.
+        :param scriptptr: a script position, None when the fringe is empty and nothing is dropped
+        :return: None
+        """
+        if scriptptr is None:
+            return
+        for ptr in [ptr for ptr in self.states if ptr < scriptptr]:
+            del self.states[ptr]
+        self.superseded = set(node for node in self.superseded if node[1] >= scriptptr)
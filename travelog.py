@@ -0,0 +1,96 @@
+"""
+A route's travel log is a chain of immutable tuples ( parent, kind, *args ) where parent is the previous event or None.
+Children share the chain with the route they were copied from, so copying a route never copies the log, and the text
+which ends up in the report is only rendered for the solutions which are written out.
+"""
+
+# Travel log event kinds
+LOG_TEXT = 0
+LOG_DEBUG = 1
+LOG_ZONE = 2
+LOG_ENCOUNTER = 3
+LOG_RANDOM = 4
+LOG_RIVER = 5
+LOG_EVENT = 6
+LOG_LETE_SEED = 7
+LOG_VELDT_PENALTY = 8
+LOG_EXTRA_STEPS = 9
+
+LOG_FORMATS = {
+    LOG_TEXT: "%s",
+    LOG_DEBUG: "--- %x %x %x %x %x %s",
+    LOG_ZONE: "%s threat steps in encounter zone %x.",
+    LOG_LETE_SEED: "*** MANIPULATE LETE W/ RETURNER TO SEED %s ***",
+    LOG_VELDT_PENALTY: "*** VELDT PENALTY +%s ***",
+    LOG_EXTRA_STEPS: "*** TAKE %s EXTRA STEPS ***",
+}
+
+# these kinds are ( formid, cost ) records rendered with the formation's precomputed label
+LOG_FORMATION_PREFIXES = {
+    LOG_ENCOUNTER: "ENCOUNTER: ",
+    LOG_RANDOM: "RANDOM EVENT: ",
+    LOG_RIVER: "RIVER: ",
+}
+
+# names of the formation kinds in structured reports
+LOG_KIND_NAMES = {
+    LOG_ENCOUNTER: "encounter",
+    LOG_RANDOM: "random",
+    LOG_RIVER: "river",
+    LOG_EVENT: "event",
+}
+
+
+def render_event(event, formations):
+    """
+    Renders a single travel log event as the line of text it represents
+    :param event: a ( parent, kind, *args ) travel log tuple
+    :param formations: dict of formid to Formation used to label formation events
+    :return: the line without a trailing newline
+    """
+    kind = event[1]
+    if kind in LOG_FORMATION_PREFIXES:
+        formid, cost = event[2], event[3]
+        return "%s%s COST: %s" % (LOG_FORMATION_PREFIXES[kind], formations[formid].label, cost)
+    elif kind == LOG_EVENT:
+        return "EVENT: %s" % formations[event[2]].label
+    return LOG_FORMATS[kind] % event[2:]
+
+
+def iter_events(tail):
+    """
+    Walks a travel log chain from the first event to the last
+    :param tail: the most recent event of the chain or None for an empty log
+    :return: list of events in the order they were logged
+    """
+    events = []
+    while tail is not None:
+        events.append(tail)
+        tail = tail[0]
+    events.reverse()
+    return events
+
+
+def render_travelog(tail, formations):
+    return "".join(render_event(e, formations) + "\n" for e in iter_events(tail))
+
+
+def formation_records(tail, formations):
+    """
+    Lists the formations fought in a travel log for structured reports
+    :param tail: the most recent event of the chain or None for an empty log
+    :param formations: dict of formid to Formation used to label formation events
+    :return: list of dicts with the kind of battle, the formation id, its label and its cost ( None for events )
+    """
+    records = []
+    for event in iter_events(tail):
+        kind = event[1]
+        if kind in LOG_FORMATION_PREFIXES:
+            formid, cost = event[2], event[3]
+        elif kind == LOG_EVENT:
+            formid, cost = event[2], None
+        else:
+            continue
+        records.append({"kind": LOG_KIND_NAMES[kind], "formid": formid, "formation": formations[formid].label,
+                        "cost": cost})
+    return records